@@ -1,22 +1,32 @@
+import time
+
+# Used to report how long the bot took from starting the script to being ready
+start_time = time.perf_counter()
+
 import pathlib
-import shutil
-import pdf2image
-import requests
+import hashlib
+import aiohttp
 import json
 import inspect
+import io
 import sys
 import discord
 import os
-import gdown
-import time
 import asyncio
-import random
+import cProfile
+import logging
+import botlog
+import metrics
+import scheduler
+import speiseplan
+import tetris
 
 from pathlib import Path
-from discord.ext import tasks, commands
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from discord.ext import commands
 
 from colorama import Fore, Style
-from pdf2image import convert_from_path, convert_from_bytes
 
 # Make sure that the user is running Python 3.8 or higher
 if sys.version_info < (3, 8):
@@ -24,25 +34,13 @@ if sys.version_info < (3, 8):
 
 # Now make sure that the discord.py library is installed or/and is up to date
 try:
-    from discord import app_commands, Intents, Client, Interaction
+    from discord import app_commands, Intents, Client, Interaction, MessageReferenceType
 except ImportError:
     exit(
         "Either discord.py is not installed or you are running an older and unsupported version of it."
         "Please make sure to check that you have the latest version of discord.py! (try reinstalling the requirements?)"
     )
 
-# inspect.cleandoc() is used to remove the indentation from the message
-# when using triple quotes (makes the code much cleaner)
-# Typicly developers woudln't use cleandoc rather they move the text
-# all the way to the left
-print(inspect.cleandoc(f"""
-    Hey, welcome to the active developer badge bot.
-    Please enter your bot's token below to continue.
-
-    {Style.DIM}Don't close this application after entering the token
-    You may close it after the bot has been invited and the command has been ran{Style.RESET_ALL}
-"""))
-
 # Try except block is useful for when you'd like to capture errors
 try:
     with open("config.json") as f:
@@ -53,54 +51,34 @@ except (FileNotFoundError, json.JSONDecodeError):
     config = {}
 
 
-while True:
-    # If no token is stored in "config" the value defaults to None
-    token = config.get("token", None)
-    if token:
-        print(f"\n--- Detected token in {Fore.GREEN}./config.json{Fore.RESET} (saved from a previous run). Using stored token. ---\n")
-    else:
-        # Take input from the user if no token is detected
-        token = input("> ")
-
-    # Validates if the token you provided was correct or not
-    # There is also another one called aiohttp.ClientSession() which is asynchronous
-    # However for such simplicity, it is not worth playing around with async
-    # and await keywords outside of the event loop
-    try:
-        data = requests.get("https://discord.com/api/v10/users/@me", headers={
-            "Authorization": f"Bot {token}"
-        }).json()
-    except requests.exceptions.RequestException as e:
-        if e.__class__ == requests.exceptions.ConnectionError:
-            exit(f"{Fore.RED}ConnectionError{Fore.RESET}: Discord is commonly blocked on public networks, please make sure discord.com is reachable!")
-
-        elif e.__class__ == requests.exceptions.Timeout:
-            exit(f"{Fore.RED}Timeout{Fore.RESET}: Connection to Discord's API has timed out (possibly being rate limited?)")
+# If no token is stored in "config" the value defaults to None
+token = config.get("token", None)
+# The user is asked for one when the script is started, see the bottom of this file
 
-        # Tells python to quit, along with printing some info on the error that occured
-        exit(f"Unknown error has occurred! Additional info:\n{e}")
+# The token is not checked here anymore. Logging in fetches users/@me through
+# the bot's own aiohttp session anyway and fails with LoginFailure if the
+# token is wrong, see main() at the bottom of this file.
 
-    # If the token is correct, it will continue the code
-    if data.get("id", None):
-        break  # Breaks out of the while loop
+def save_config():
+    # This is used to save the token for the next time you run the bot
+    with open("config.json", "w") as f:
+        # Check if 'token' key exists in the config.json file
+        config["token"] = token
 
-    # If the token is incorrect, an error will be printed
-    # You will then be asked to enter a token again (while Loop)
-    print(f"\nSeems like you entered an {Fore.RED}invalid token{Fore.RESET}. Please enter a valid token (see Github repo for help).")
+        # This dumps our working setting to the config.json file
+        # Indent is used to make the file look nice and clean
+        # If you don't want to indent, you can remove the indent=2 from code
+        json.dump(config, f, indent=2)
 
-    # Resets the config so that it doesn't use the previous token again
-    config.clear()
+# Fingerprints of the last synced command trees (global and per guild), stored next to config.json
+command_tree_file = "command_tree.json"
 
-
-# This is used to save the token for the next time you run the bot
-with open("config.json", "w") as f:
-    # Check if 'token' key exists in the config.json file
-    config["token"] = token
-
-    # This dumps our working setting to the config.json file
-    # Indent is used to make the file look nice and clean
-    # If you don't want to indent, you can remove the indent=2 from code
-    json.dump(config, f, indent=2)
+# Everything the bot logs while running goes through these, see botlog.py
+log = logging.getLogger('bosco')
+menu_log = logging.getLogger('bosco.speiseplan')
+tetris_log = logging.getLogger('bosco.tetris')
+# Per tick debug output, at most debug_log_rate lines per second
+tick_log = botlog.RateLimitedLog(tetris_log, config.get("debug_log_rate", 10))
 
 class BoscoBot(Client):
     def __init__(self, *, intents: Intents):
@@ -109,7 +87,90 @@ class BoscoBot(Client):
 
     async def setup_hook(self) -> None:
         """ This is called when the bot boots, to setup the global commands """
-        await self.tree.sync()
+        if tetris_controls == "buttons":
+            # One view handles the buttons of every game message
+            self.add_view(TetrisControls())
+
+        # Counts every request discord.py makes, by route ("PATCH /channels/{channel_id}/messages/{message_id}")
+        request = self.http.request
+        async def counted_request(route, **kwargs):
+            api_requests.inc(route.key)
+            return await request(route, **kwargs)
+        self.http.request = counted_request
+
+        if menu_schedule is not None:
+            self.menu_task = asyncio.create_task(menu_scheduler())
+
+        if config.get("metrics_port"):
+            self.metrics_runner = await metrics.serve(config["metrics_port"], profiler=game_profiler)
+            log.info("metrics served on http://127.0.0.1:%s/metrics", config['metrics_port'])
+
+        await self.sync_commands()
+
+    async def sync_commands(self):
+        """ The tree is only synced when the commands changed since the last sync.
+            With "dev_guild_id" in config.json the commands are synced to that
+            guild only, where changes show up instantly instead of propagating.
+            The commands registered in the other mode are removed when the mode
+            changes, otherwise every command shows up twice in the dev guild.
+            So a dev_guild_id is meant for a test bot, the global commands of
+            its application are gone until it is taken out again.
+        """
+        guild = None
+        scope = "global"
+        if config.get("dev_guild_id"):
+            guild = discord.Object(id=int(config["dev_guild_id"]))
+            scope = f"guild:{guild.id}"
+            self.tree.copy_global_to(guild=guild)
+
+        try:
+            with open(command_tree_file) as f:
+                synced = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            synced = {}
+
+        fingerprint = self.command_fingerprint(guild)
+        stale = [other for other in synced if other != scope]
+        if synced.get(scope) == fingerprint and not stale:
+            log.info("command tree unchanged (%s), skipping sync", scope)
+            return
+
+        if synced.get(scope) != fingerprint:
+            await self.tree.sync(guild=guild)
+            synced[scope] = fingerprint
+            log.info("command tree synced (%s)", scope)
+        for other in stale:
+            try:
+                await self.remove_commands(other)
+                log.info("commands removed (%s)", other)
+            except discord.HTTPException:
+                log.exception("commands couldn't be removed (%s)", other) #e.g. the bot left that guild
+            del synced[other]
+        with open(command_tree_file, "w") as f:
+            json.dump(synced, f, indent=2)
+
+    async def remove_commands(self, scope):
+        """ Registers an empty command list for a scope of command_tree_file ("global" or "guild:<id>")
+            Only on discord, the commands in self.tree stay as they are
+        """
+        if scope == "global":
+            await self.http.bulk_upsert_global_commands(self.application_id, payload=[])
+        else:
+            await self.http.bulk_upsert_guild_commands(self.application_id, int(scope.split(":", 1)[1]), payload=[])
+
+    def command_fingerprint(self, guild=None):
+        """ SHA-256 of the serialised command tree
+            The application id is part of it, so a token for another bot syncs again
+        """
+        payload = []
+        for command in self.tree.get_commands(guild=guild):
+            try:
+                payload.append(command.to_dict(self.tree)) #discord.py 2.4+
+            except TypeError:
+                payload.append(command.to_dict())
+        payload.sort(key=lambda c: (c.get("type", 1), c["name"]))
+        data = json.dumps({"application_id": self.application_id, "commands": payload}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
 
 # Variable to store the bot class and interact with it
 client = BoscoBot(intents=Intents.default())
@@ -128,107 +189,241 @@ async def on_ready():
         {Fore.LIGHTBLUE_EX}https://discord.com/api/oauth2/authorize?client_id={client.user.id}&scope=applications.commands%20bot{Fore.RESET}
     """), end="\n\n")
     
-    print("Ready!")
+    # on_ready runs again after every reconnect, the start up time only matters once
+    global start_time
+    if start_time is not None:
+        print(f"Ready! (cold start took {time.perf_counter() - start_time:.2f}s)")
+        start_time = None
+    else:
+        print("Ready!")
     
-@tasks.loop(hours=24)
-async def pdf_loop():
+# Rendered menu images survive restarts, so the weekly menu is only rasterised once
+menu_cache = speiseplan.MenuCache(
+    config.get("cache_folder", speiseplan.cache_folder),
+    max_age=config.get("cache_max_age_days", 28) * 86400,
+    max_bytes=config.get("cache_max_mb", 500) * 1024 * 1024,
+)
+# How many pdfs are rasterised at the same time (None = one per cpu core)
+render_workers = config.get("render_workers", None)
+# Size and encoding of the posted images, e.g. {"width": 1600, "grayscale": true, "format": "WEBP"}
+render_profile = speiseplan.RenderProfile(**config.get("render_profile", {}))
+# Menu pages are grouped into as few messages as possible, Discord allows 10 attachments
+# per message and limits the total upload size of a message
+menu_pages_per_message = min(config.get("menu_pages_per_message", 10), 10)
+upload_limit = config.get("upload_limit_mb", 10) * 1024 * 1024
+# The dishes of the current pdfs by day, answers /menu without touching the pdfs
+menu_index = speiseplan.MenuIndex(config.get("menu_index_file", speiseplan.text_index_name))
+# Channels the menu is posted in. The images are only uploaded to the first one,
+# the others get that message forwarded
+menu_channels = config.get("menu_channels", [1205332175302692894])
+#menu_channels = config.get("menu_channels", [1166651023822159882])
+
+# When the menu is posted, as a cron line (minute hour day-of-month month day-of-week)
+# in menu_timezone. The default is every Monday at 06:00, "" turns the schedule off
+menu_timezone = scheduler.load_timezone(config.get("menu_timezone", "Europe/Berlin"))
+menu_cron = config.get("menu_schedule", "0 6 * * 1")
+menu_schedule = scheduler.Schedule(menu_cron, menu_timezone) if menu_cron else None
+# Held while the menu is posted, there is never more than one run at a time
+menu_lock = asyncio.Lock()
+# Seconds to wait before a failed run is tried again
+menu_retry = config.get("menu_retry_minutes", 30) * 60
+
+async def menu_scheduler():
+    """ Posts the menu whenever it is due, runs as long as the bot does
+        A run that was due while the bot was offline is done once right after it starts.
+    """
+    await client.wait_until_ready()
+    if menu_timezone is None:
+        menu_log.warning("time zone %r not found, the menu schedule uses local time", config.get("menu_timezone", "Europe/Berlin"))
+    # A menu that should have been replaced while the bot was offline, discord.py's
+    # delete_after timers don't survive a restart
+    await delete_posted_menu(expired_only=True)
+    menu_log.info("next menu run at %s", menu_schedule.due())
+    while True:
+        wait = menu_schedule.due().timestamp() - time.time()
+        if wait > 0:
+            # Never sleeps longer than an hour, so a changed clock or a machine
+            # that was suspended can't make it miss a run
+            await asyncio.sleep(min(wait, 3600))
+            continue
+        try:
+            if not await run_menu("scheduled" if wait > -600 else "missed while offline"):
+                await asyncio.sleep(60) #a run started with /foodloops is still going
+        except Exception:
+            menu_log.exception("menu run failed, trying again in %d minutes", menu_retry // 60)
+            await asyncio.sleep(menu_retry)
+
+def menu_lifetime():
+    """ Seconds the posted menu stays up: until the next scheduled run replaces it,
+        or a day when there is no schedule
+    """
+    if menu_schedule is None:
+        return 86400
+    return max(3600, menu_schedule.upcoming().timestamp() - time.time())
 
-    files = os.listdir('Speiseplan')
-    files.sort()
-    #delte exiting the contents of the folder Speiseplan
-    folder = 'Speiseplan'
-    
-    for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
+def remember_posted(msg, lifetime):
+    """ Keeps the id of a posted menu message in the schedule state, so the next
+        run deletes it even if the bot was restarted and delete_after was lost
+    """
+    if menu_schedule is not None:
+        menu_schedule.add_posted(msg.channel.id, msg.id, datetime.now(timezone.utc) + timedelta(seconds=lifetime))
+
+async def delete_posted_menu(expired_only=False):
+    """ Deletes the menu messages the last run posted
+        expired_only keeps them if they are meant to stay up a while longer
+    """
+    if menu_schedule is None or not menu_schedule.posted:
+        return
+    if expired_only and menu_schedule.posted_until is not None and menu_schedule.posted_until > datetime.now(timezone.utc):
+        return
+    for channel_id, message_id in menu_schedule.posted:
+        channel = client.get_channel(channel_id)
+        if channel is None:
+            menu_log.warning("menu channel %s not found, message %s stays", channel_id, message_id)
+            continue
         try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path) 
-                print(f"> {Style.BRIGHT}{filename}{Style.RESET_ALL} deleted")
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (file_path, e))
-    
-    #download the pdf from google drive with gdown
-    print(f"> downloading pdfs from google drive")
-    url = "https://drive.google.com/drive/folders/1WB5lNSE901jWigIAk0dgxKIG-ljaSzQO"
-    gdown.download_folder(url, quiet=True, use_cookies=False)
-    print(f"> pdfs downloaded")
-    
-    #wait 5 seconds
-    print(f"> waiting 5 seconds")
-    time.sleep(5)
-
-    #sort the downloaded files alphabetically
-    print(f"> sorting files")
-    files = os.listdir('Speiseplan')
-    files.sort()
-    time.sleep(2)
-    print(f"> files sorted")
-
-    #rename the pdf files inside the folder Speiseplan
-    counter = 2
-    filenames = sorted(os.listdir('Speiseplan'), reverse=False)
-    for filename in os.listdir('Speiseplan'):
-        if filename.endswith('.pdf'):
-            os.rename(f'Speiseplan/{filename}', f'Speiseplan/' + str(counter) + '.pdf')
-            counter += 1
-            print(f"> {Style.BRIGHT}{filename}{Style.RESET_ALL} renamed")
-            
-    #sort the downloaded files alphabetically
-    print(f"> sorting files Part 2")
-    files = os.listdir('Speiseplan')
-    files.sort(reverse=False)
-    time.sleep(2)
-    print(f"> files sorted 2 *electric boogaloo")
-    
-    #convert all pdf files  to an image
-    popplerpath = r'poppler-23.11.0\Library\bin'
-    
-    counter2 = 2 
-
-    filenames = sorted(os.listdir('Speiseplan'), reverse=False)
-    for filename in os.listdir('Speiseplan'):
-        if filename.endswith('.pdf'):
-            pages = convert_from_path((f'Speiseplan/' + str(counter2) +'.pdf'), 500, first_page=1, last_page=1)
-            #pages = convert_from_path((f'Speiseplan/' + str(counter2) +'.pdf'), 500, poppler_path=popplerpath, first_page=1, last_page=1)
-            for page in pages:
-                page.save('Speiseplan/' + str(counter2) +'.jpg', 'JPEG')
-                counter2 += 1
-                print(f"> {Style.BRIGHT}{filename}{Style.RESET_ALL} converted to image")
-                time.sleep(2)
-                
-    #sort the downloaded files alphabetically
-    print(f"> sorting files Part 3")
-    files = os.listdir('Speiseplan')
-    files.sort(reverse=True)
-    time.sleep(2)
-    print(f"> files sorted 3 *Revenge of the Sith")
-                
-    print('sending weekly message...')
-    #channel = client.get_channel(1166651023822159882)
-    channel = client.get_channel(1205332175302692894)
-    
-    #send all .jpg files in the folder Speiseplan in reversed alphabetical order
-    counter3 = 2
-    
-    # Get the list of files, sort them in reverse alphabetical order
-    filenames = sorted(os.listdir('Speiseplan'), reverse=False)
-    for filename in filenames:
-        if filename.endswith('.jpg'):
-            file = discord.File(f'Speiseplan/' + str(counter3) +'.jpg')
-            counter3 += 1
-            await channel.send(file=file, delete_after=86400)
-            print(f"> {Style.BRIGHT}{filename}{Style.RESET_ALL} sent")
-            time.sleep(2)
-
-    print(f"> current time: {time.ctime()} loop will restart in 1 day(s)")
+            await channel.get_partial_message(message_id).delete()
+        except discord.NotFound:
+            pass #delete_after or someone else got to it first
+        except discord.HTTPException:
+            menu_log.exception("old menu message %s couldn't be deleted", message_id)
+    menu_schedule.clear_posted()
+
+async def run_menu(reason):
+    """ Runs pdf_loop, unless it is running already, then it returns False """
+    if menu_lock.locked():
+        return False
+    async with menu_lock:
+        menu_log.info("menu run started (%s)", reason)
+        await delete_posted_menu() #the new menu replaces the old one
+        await pdf_loop()
+        if menu_schedule is not None:
+            menu_log.info("menu run done, next one at %s", menu_schedule.done())
+    return True
+
+async def pdf_loop():
+    # The drive folder is synced first (only new or changed pdfs are
+    # downloaded), then every pdf goes render -> upload. The producer hands
+    # the pdfs to the render pool, the consumer collects the finished images
+    # in page order and posts them from memory, up to 10 per message, while
+    # the next ones are still rendering.
+    # All blocking work runs in executor threads, the event loop keeps
+    # serving games and commands.
+    loop = asyncio.get_running_loop()
+    folder = speiseplan.folder
+
+    menu_log.info("syncing pdfs from google drive")
+    with speiseplan.stage_seconds.time('sync'):
+        listing = await loop.run_in_executor(None, speiseplan.list_folder, speiseplan.drive_url)
+        entries, added, changed, removed = await loop.run_in_executor(None, speiseplan.sync_folder, listing, folder)
+    for filename in added:
+        menu_log.info("%s downloaded", filename)
+    for filename in changed:
+        menu_log.info("%s changed, downloaded again", filename)
+    for filename in removed:
+        menu_log.info("%s deleted", filename)
+
+    menu_log.info("sending weekly message...")
+    channels = []
+    for channel_id in menu_channels:
+        channel = client.get_channel(channel_id)
+        if channel is None:
+            menu_log.warning("menu channel %s not found, skipping it", channel_id)
+        else:
+            channels.append(channel)
+    if not channels:
+        raise RuntimeError("none of the menu channels were found")
+    channel, subscribers = channels[0], channels[1:]
+    lifetime = menu_lifetime()
+
+    queue = asyncio.Queue()
+    render_pool = speiseplan.render_pool(render_workers) #the same pool `python speiseplan.py <pdf>` benchmarks
+
+    async def produce():
+        try:
+            for number, entry in enumerate(entries, start=2):
+                pdf_path = os.path.join(folder, entry['name'])
+                image = loop.run_in_executor(render_pool, speiseplan.load_or_render, menu_cache, entry['id'], pdf_path, render_profile, entry['sha256'])
+                await queue.put((number, entry['name'], image))
+        finally:
+            await queue.put(None) #tell the consumer there is nothing left
+
+    async def send_pages(pages):
+        #one message with up to 10 attachments, in page order (2.jpg, 3.jpg, ...) straight from memory
+        files = [discord.File(io.BytesIO(data), filename=str(number) + render_profile.extension) for number, _, data in pages]
+        with speiseplan.stage_seconds.time('upload'):
+            msg = await channel.send(files=files, delete_after=lifetime)
+        remember_posted(msg, lifetime)
+        for _, filename, _ in pages:
+            menu_log.info("%s sent", filename)
+        if subscribers:
+            await send_to_subscribers(msg)
+
+    async def send_to_subscribers(msg):
+        # The other channels get the uploaded message forwarded, so the upload
+        # doesn't grow with the number of channels. A forward is a copy with
+        # its own attachments, it keeps working after the signed cdn urls of
+        # the upload expire (about a day, the menu stays up for a week) and
+        # if the uploaded message is deleted. The sends run at the same time,
+        # every channel has its own rate limit bucket.
+        reference = msg.to_reference(type=MessageReferenceType.forward)
+        with speiseplan.stage_seconds.time('fan-out'):
+            results = await asyncio.gather(*(subscriber.send(reference=reference, delete_after=lifetime) for subscriber in subscribers), return_exceptions=True)
+        for subscriber, result in zip(subscribers, results):
+            if isinstance(result, Exception):
+                menu_log.error("menu couldn't be sent to %s", subscriber.id, exc_info=result)
+            else:
+                remember_posted(result, lifetime)
+
+    async def consume():
+        pages = []
+        pages_size = 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            number, filename, image = item
+            data, from_cache = await image
+            if from_cache:
+                menu_log.info("%s unchanged, image taken from cache", filename)
+            else:
+                menu_log.info("%s converted to image", filename)
+            #the next page doesn't fit into this message anymore
+            if pages and (len(pages) == menu_pages_per_message or pages_size + len(data) > upload_limit):
+                await send_pages(pages)
+                pages = []
+                pages_size = 0
+            pages.append((number, filename, data))
+            pages_size += len(data)
+        if pages:
+            await send_pages(pages)
+
+    async def build_index():
+        # pdftotext runs next to the renderer, a pdf it can't read doesn't stop the images
+        try:
+            with speiseplan.stage_seconds.time('extract'):
+                extracted = await loop.run_in_executor(None, menu_index.update, entries, folder)
+            await loop.run_in_executor(None, menu_index.save)
+        except Exception:
+            menu_log.exception("menu text couldn't be extracted")
+            return
+        for filename in extracted:
+            menu_log.info("%s text extracted", filename)
+
+    try:
+        await asyncio.gather(produce(), consume(), build_index())
+    finally:
+        render_pool.shutdown(wait=False)
+
+    for key in await loop.run_in_executor(None, menu_cache.evict):
+        menu_log.info("%s evicted from cache", key)
+    await loop.run_in_executor(None, menu_cache.save)
 
 @client.tree.command()
 @commands.guild_only()
 async def hello(interaction: Interaction):
     # Responds in the console that the command has been ran
-    print(f"> {Style.BRIGHT}{interaction.user}{Style.RESET_ALL} used the command.")
+    log.info("%s used /%s", interaction.user, interaction.command.name)
 
     # Then responds in the channel with this message
     await interaction.response.send_message(inspect.cleandoc(f"""
@@ -239,9 +434,12 @@ async def hello(interaction: Interaction):
 @commands.guild_only()
 async def foodloops(interaction: Interaction):
     # Responds in the console that the command has been ran
-    print(f"> {Style.BRIGHT}{interaction.user}{Style.RESET_ALL} used the command.")
+    log.info("%s used /%s", interaction.user, interaction.command.name)
 
-    pdf_loop.start()
+    if menu_lock.locked():
+        await interaction.response.send_message("The menu is being posted already.", ephemeral=True, delete_after=10)
+        return
+    run_in_background(run_menu(f"/foodloops by {interaction.user}"))
 
     # Then responds in the channel with this message
     await interaction.response.send_message(inspect.cleandoc(f"""
@@ -252,78 +450,213 @@ async def foodloops(interaction: Interaction):
 @commands.guild_only()
 async def praiseme(interaction: Interaction):
     # Responds in the console that the command has been ran
-    print(f"> {Style.BRIGHT}{interaction.user}{Style.RESET_ALL} used the command.")
+    log.info("%s used /%s", interaction.user, interaction.command.name)
 
     # Then responds in the channel with this message
     await interaction.response.send_message(inspect.cleandoc(f"""
         **{interaction.user}**, you are a good egg and i am pround of you.
     """))
 
+def menu_today():
+    """ Today in menu_timezone, "heute" in /menu is the same day the menu is posted for """
+    return datetime.now(menu_timezone).timetuple()
+
+@client.tree.command()
+@commands.guild_only()
+@app_commands.describe(day="Montag, Dienstag, ... or heute/morgen, every day if left out", search="Only dishes that contain this")
+async def menu(interaction: Interaction, day: str = None, search: str = None):
+    # Responds in the console that the command has been ran
+    log.info("%s used /%s", interaction.user, interaction.command.name)
+
+    number = None
+    if day:
+        number = speiseplan.parse_day(day, menu_today())
+        if number is None:
+            await interaction.response.send_message(f"I don't know the day **{day}**, try Montag, Di or heute.", ephemeral=True, delete_after=10)
+            return
+
+    # Only reads the index in memory, the pdfs aren't touched
+    dishes = menu_index.lookup(number, search)
+    if not dishes:
+        await interaction.response.send_message("Nothing found on the Speiseplan.", ephemeral=True, delete_after=10)
+        return
+
+    by_day = {}
+    for day_name, dish in dishes:
+        by_day.setdefault(day_name, []).append(dish)
+    embed = discord.Embed(title='Speiseplan', color=embed_colour)
+    for day_name, day_dishes in by_day.items():
+        value = '\n'.join('• ' + dish for dish in day_dishes)
+        if len(value) > 800: #7 days have to fit into the 6000 characters of an embed
+            value = value[:799] + '…'
+        embed.add_field(name=day_name, value=value, inline=False)
+    await interaction.response.send_message(embed=embed)
+
 def cooldown_command(rate, per, type=commands.BucketType.user):
     return commands.cooldown(rate, per, type)
 
-command_in_use = False
+# "buttons" puts the game controls in buttons under the message, "reactions" uses reactions
+# Buttons need one api call per move, reactions need the reaction and removing it again
+tetris_controls = config.get("tetris_controls", "buttons")
 
-@client.tree.command()
+# Every game is logged to <folder>/<message id>.ttrp, replay them with `python tetris.py replay <file>`
+# "" turns the logs off
+tetris_replay_folder = config.get("tetris_replay_folder", "Tetris_replays")
+# One thread, so the writes to a log file happen in the order they were made
+replay_writer = ThreadPoolExecutor(max_workers=1)
+# A running game is appended to its log every this many ticks, so a crash or a
+# restart only loses the last few
+replay_flush_ticks = config.get("tetris_replay_flush_ticks", 30)
+
+# Channels Tetris can be played in, an empty list allows every channel
+tetris_channels = config.get("tetris_channels", [1167074199144235018])
+#tetris_channels = config.get("tetris_channels", [902414002980782110])
+
+@client.tree.command(name="tetris")
 @commands.guild_only()
 @cooldown_command(1, 60)
-async def tetris(interaction: Interaction): #Starts embed
-    print(f"> {Style.BRIGHT}{interaction.user}{Style.RESET_ALL} used the command.")
-    global command_in_use
-    
-    game_channel = client.get_channel(1167074199144235018)
-    #game_channel = client.get_channel(902414002980782110)
-    channel_id = interaction.channel
-    print(f">{channel_id} + {game_channel}")
-    
-    if channel_id == game_channel: 
-        if command_in_use:
-            await game_channel.send("The command is currently in use. Please try again later.", delete_after=10)
-            return
+async def tetris_command(interaction: Interaction): #Starts embed
+    log.info("%s used /%s", interaction.user, interaction.command.name)
+
+    game_channel = interaction.channel
+    tetris_log.debug("channel %s, tetris channels %s", game_channel.id, tetris_channels)
     
-        await interaction.response.defer()
+    if not tetris_channels or game_channel.id in tetris_channels:
         user = interaction.user
-    
-        # Set the flag to indicate the command is in use
-        command_in_use = True
+        #one game per player, but any number of players can play at the same time
+        for session in sessions.values():
+            if session.user_id == user.id:
+                await interaction.response.send_message("You are already playing a game. Press ❌ on it to stop it first.", delete_after=10, ephemeral=True)
+                return
+
+        await interaction.response.defer()
 
-        await reset_game()
-        embed = discord.Embed(title='Tetris in Discord', description=format_board_as_str(), color=embed_colour)
+        embed = discord.Embed(title='Tetris in Discord', description=tetris.format_board_as_str(tetris.make_empty_board()[1]), color=embed_colour)
         embed.add_field(name='How to Play:', value='Use ⬅ ⬇ ➡ to move left, down, and right respectively. \n  \n Use 🔃 to rotate the shape clockwise. \n \n Press ▶ to Play.', inline=False)
-        msg = await game_channel.send(embed=embed)
+        if tetris_controls == "buttons":
+            msg = await game_channel.send(embed=embed, view=TetrisControls())
+        else:
+            msg = await game_channel.send(embed=embed)
 
-        #Add button choices / reactions
-        await msg.add_reaction("▶") #Play
+        # Every game message gets its own session, stored by the message id
+        sessions[msg.id] = TetrisSession(msg, user.id)
+
+        if tetris_controls != "buttons":
+            #Add button choices / reactions
+            await msg.add_reaction("▶") #Play
     
         header = await interaction.followup.send("Lets Play Tetris")
         await header.delete()
-    
-        #On new reaction:
-        #Update board and board_as_str
-        #await msg.edit(embed=embed)
-
-        # Store the user's ID for later verification
-        user_id = str(user.id)
-        client.user_data[user_id] = msg.id
         
     else:
         await interaction.response.send_message("You can't use this command in this channel.", delete_after=10, ephemeral=True)
 
+# Reactions used as game controls and the input they stand for
+reaction_inputs = {
+    "⬅": 'left', #move 1 left
+    "➡": 'right', #move +1 right
+    "⬇": 'down', #drop
+    "🔃": 'rotate', #rotate clockwise
+}
+
+# Inputs a game can queue up between two ticks, anything above that is dropped
+max_queued_inputs = 16
+
+# Fire and forget tasks, a reference is kept until they are done so they aren't garbage collected
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.ensure_future(coro) #also takes futures, like the ones from run_in_executor()
+    background_tasks.add(task)
+    task.add_done_callback(background_task_done)
+    return task
+
+def background_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("background task failed", exc_info=task.exception())
+
+def start_game(session):
+    """ Resets the session and starts its game loop """
+    if session.task is not None:
+        session.task.cancel() #never two loops ticking the same session
+    session.starting = False
+    session.reset()
+    while not session.inputs.empty():
+        session.inputs.get_nowait() #inputs from the last game
+    session.get_random_shape()
+    session.log.start(session.seed, asyncio.get_running_loop().time())
+    # The game runs in its own task, so the reaction/button handler returns right away
+    session.task = asyncio.create_task(run_game(session))
+    session.task.add_done_callback(lambda task: game_task_done(session, task))
+
+def game_task_done(session, task):
+    """ Logs a game that ended with an error, a game whose message was deleted loses its session
+        so the player can start a new one with /tetris
+        The ticks that weren't written yet are saved however the game ended, a game
+        that failed is the one worth replaying.
+    """
+    background_task_done(task)
+    save_replay(session)
+    if task.cancelled() or not isinstance(task.exception(), discord.NotFound):
+        return
+    if sessions.get(session.msg.id) is session:
+        del sessions[session.msg.id]
+        tetris_log.info("game message %s is gone, session dropped", session.msg.id)
+
+def save_replay(session):
+    """ Appends the replay records of the session to its log file, in the background """
+    data = session.log.take()
+    if not tetris_replay_folder or not data:
+        return
+    path = os.path.join(tetris_replay_folder, f"{session.msg.id}{tetris.replay_extension}")
+    run_in_background(asyncio.get_running_loop().run_in_executor(replay_writer, tetris.append_replay, path, data))
+
+async def stop_game(session):
+    """ Ends the game and deletes its message """
+    #In future maybe put score screen here or a message saying stopping.
+    if session.task is not None:
+        session.task.cancel()
+    save_replay(session)
+    del sessions[session.msg.id]
+    await session.msg.delete()
+
+def drop_session(message_id):
+    """ Forgets the game of a message that was deleted, so its player can start a new one with /tetris """
+    session = sessions.pop(message_id, None)
+    if session is None:
+        return #not a game message, or stop_game() dropped it already
+    if session.task is not None:
+        session.task.cancel()
+    save_replay(session)
+    tetris_log.info("game message %s was deleted, session dropped", message_id)
+
+# Raw events, so messages from before the last restart or not in the message cache count too
+@client.event
+async def on_raw_message_delete(payload):
+    drop_session(payload.message_id)
+
+@client.event
+async def on_raw_bulk_message_delete(payload):
+    for message_id in payload.message_ids:
+        drop_session(message_id)
+
 @client.event
 async def on_reaction_add(reaction, user):
-    global command_in_use
-    global h_movement
-    global rotation_pos
-    # Check if the user who reacted is the same user who initiated the command
-    message_id = reaction.message.id
-    user_id = str(user.id)
-    if user_id in client.user_data and client.user_data[user_id] == message_id:
-        msg = reaction.message
-        if str(reaction.emoji) == "▶": #Play button pressed
-            print('User pressed play')
-            await reset_game()
+    # Check if the user who reacted is the same user who started the game on this message
+    session = sessions.get(reaction.message.id)
+    if session is None or user.id != session.user_id:
+        return
+
+    msg = session.msg
+    if str(reaction.emoji) == "▶": #Play button pressed
+        if session.playing():
+            return #already playing
+        session.starting = True #set before the first await, a second ▶ in between is ignored
+        tetris_log.info("%s started a game", user)
+        try:
             await msg.remove_reaction("❌", client.user) #Remove delete
-            embed = discord.Embed(description=format_board_as_str(), color=embed_colour)
+            embed = discord.Embed(description=tetris.format_board_as_str(tetris.make_empty_board()[1]), color=embed_colour)
             await msg.remove_reaction("▶", user)
             await msg.remove_reaction("▶", client.user)
             await msg.edit(embed=embed)
@@ -332,411 +665,313 @@ async def on_reaction_add(reaction, user):
             await msg.add_reaction("➡") #Right
             await msg.add_reaction("🔃") #Rotate
             await msg.add_reaction("❌") #Stop game
-            starting_shape = get_random_shape()
-            await run_game(msg, starting_shape)
-        
+        finally:
+            session.starting = False
+        start_game(session)
+
+    # Moves go into the game's input queue, the game loop applies them in
+    # order on its next tick. Removing the player's reaction again doesn't
+    # have to finish before the next input is taken, so it runs in the background.
+    if str(reaction.emoji) in reaction_inputs: #⬅ ➡ ⬇ or 🔃 pressed
+        try:
+            session.inputs.put_nowait((reaction_inputs[str(reaction.emoji)], None, time.perf_counter()))
+        except asyncio.QueueFull:
+            tick_log.debug("game %s: input queue full, %s dropped", msg.id, reaction.emoji) #too many inputs queued up, drop this one
+        run_in_background(msg.remove_reaction(reaction.emoji, user))
+    if str(reaction.emoji) == "❌": #Stop game button pressed
+        await stop_game(session)
+    if str(reaction.emoji) == "🔴":
+        await msg.edit(content="")
+
+
+class TetrisControls(discord.ui.View):
+    """ Buttons under a game message, used instead of reactions when tetris_controls is "buttons"
+
+        The view has no timeout and fixed custom ids, so one instance added in
+        setup_hook handles the buttons of every game. A move is put into the
+        input queue together with its interaction, the game loop answers the
+        interaction with the next frame, so every press costs a single api call.
+    """
+
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        # Only the user who started the game on this message can press its buttons
+        session = sessions.get(interaction.message.id)
+        if session is None or interaction.user.id != session.user_id:
+            await interaction.response.send_message("This isn't your game, use /tetris to start your own.", ephemeral=True, delete_after=10)
+            return False
+        return True
+
+    async def queue_input(self, interaction, event):
+        session = sessions[interaction.message.id]
+        if session.task is None or session.task.done():
+            await interaction.response.defer() #not playing right now
+            return
+        # The press is answered with the next frame, discord only waits 3 seconds
+        # for that. FrameRenderer falls back to msg.edit() when it was too late.
+        try:
+            session.inputs.put_nowait((event, interaction, time.perf_counter()))
+        except asyncio.QueueFull:
+            tick_log.debug("game %s: input queue full, %s dropped", interaction.message.id, event)
+            await interaction.response.defer() #too many inputs queued up, drop this one
+
+    @discord.ui.button(emoji="⬅", style=discord.ButtonStyle.secondary, custom_id="tetris:left", row=0)
+    async def left(self, interaction: Interaction, button: discord.ui.Button):
+        await self.queue_input(interaction, 'left')
+
+    @discord.ui.button(emoji="⬇", style=discord.ButtonStyle.secondary, custom_id="tetris:down", row=0)
+    async def down(self, interaction: Interaction, button: discord.ui.Button):
+        await self.queue_input(interaction, 'down')
+
+    @discord.ui.button(emoji="➡", style=discord.ButtonStyle.secondary, custom_id="tetris:right", row=0)
+    async def right(self, interaction: Interaction, button: discord.ui.Button):
+        await self.queue_input(interaction, 'right')
+
+    @discord.ui.button(emoji="🔃", style=discord.ButtonStyle.secondary, custom_id="tetris:rotate", row=0)
+    async def rotate(self, interaction: Interaction, button: discord.ui.Button):
+        await self.queue_input(interaction, 'rotate')
+
+    @discord.ui.button(emoji="▶", style=discord.ButtonStyle.success, custom_id="tetris:play", row=1)
+    async def play(self, interaction: Interaction, button: discord.ui.Button):
+        session = sessions[interaction.message.id]
+        if session.playing():
+            await interaction.response.defer() #already playing
+            return
+        session.starting = True #set before the first await, a double click only starts one game
+        tetris_log.info("%s started a game", interaction.user)
+        embed = discord.Embed(description=tetris.format_board_as_str(tetris.make_empty_board()[1]), color=embed_colour)
+        try:
+            await interaction.response.edit_message(embed=embed)
+        finally:
+            session.starting = False
+        start_game(session)
+
+    @discord.ui.button(emoji="❌", style=discord.ButtonStyle.danger, custom_id="tetris:stop", row=1)
+    async def stop(self, interaction: Interaction, button: discord.ui.Button):
+        await interaction.response.defer()
+        await stop_game(sessions[interaction.message.id])
 
-        if str(reaction.emoji) == "⬅": #Left button pressed
-            print('Left button pressed')
-            h_movement = -1 #move 1 left
-            await msg.remove_reaction("⬅", user)
-        if str(reaction.emoji) == "➡": #Right button pressed
-            print('Right button pressed')
-            h_movement = 1 #move +1 right
-            await msg.remove_reaction("➡", user)
-        if str(reaction.emoji) == "⬇": #Down button pressed
-            print('Down button pressed')
-            global down_pressed
-            down_pressed = True
-            await msg.remove_reaction("⬇", user)
-        if str(reaction.emoji) == "🔃": #Rotate clockwise button pressed
-            print('Rotate clockwise button pressed')
-            global rotate_clockwise
-            rotate_clockwise = True
-            if rotation_pos < 3:
-                rotation_pos += 1
-            else:
-                rotation_pos = 0 #go back to original pos
-            await msg.remove_reaction("🔃", user)
-        if str(reaction.emoji) == "❌": #Stop game button pressed
-            #In future maybe put score screen here or a message saying stopping.
-            await reset_game()
-            await msg.delete()
-            command_in_use = False
-        if str(reaction.emoji) == "🔴":
-            await msg.edit(content="")
-            
-# Initialize a dictionary to store user data for the bot
-client.user_data = {}
-
-board = []
-num_of_rows = 18
-num_of_cols = 10
-empty_square = ':black_large_square:'
-blue_square = ':blue_square:'
-brown_square = ':brown_square:'
-orange_square = ':orange_square:'
-yellow_square = ':yellow_square:'
-green_square = ':green_square:'
-purple_square = ':purple_square:'
-red_square = ':red_square:'
 embed_colour = 0x077ff7 #colour of line on embeds
-points = 0
-lines = 0 #how many lines cleared
-down_pressed = False #if down button has been pressed
-rotate_clockwise = False
-rotation_pos = 0
-h_movement = 0 #amount to move left or right
-is_new_shape = False
-start_higher = False #for when near top of board
-game_over = False
-index = 0
-
-
-class Tetronimo: #Tetris pieces
-    def __init__(self, starting_pos, colour, rotation_points):
-        self.starting_pos = starting_pos #list
-        self.colour = colour
-        self.rotation_points = rotation_points #list
-
-main_wall_kicks = [ #for J, L, T, S, Z tetronimos
-                    [[0, 0], [0, -1], [-1, -1], [2, 0], [2, -1]],
-                    [[0, 0], [0, 1], [1, 1], [-2, 0], [-2, 1]],
-                    [[0, 0], [0, 1], [-1, 1], [2, 0], [2, 1]],
-                    [[0, 0], [0, -1], [1, -1], [-2, 0], [-2, -1]]
-                    ]
-
-i_wall_kicks = [ #for I tetronimo
-                [[0, 0], [0, -2], [0, 1], [1, -2], [-2, 1]],
-                [[0, 0], [0, -1], [0, 2], [-2, -1], [1, 2]],
-                [[0, 0], [0, 2], [0, -1], [-1, 2], [2, -1]],
-                [[0, 0], [0, 1], [0, -2], [2, 1], [-1, -2]]
-                ]
-
-rot_adjustments = { #to move when rotations are slightly off
-                #blue: not sure if needs any rn
-                ':blue_square:': [[0, 1], [-1, -1], [0, 0], [-1, 0]], #[[0, 0], [0, 0], [0, 0], [0, 0]]
-                #brown: left 1, right 1, right 1, left 1,
-                ':brown_square:': [[0, 0], [0, 1], [0, 0], [0, -1]], #[[0, -1], [0, 1], [0, 1], [0, -1]]'
-                #orange: left 1, nothing, right 1, nothing
-                ':orange_square:': [[0, -1], [0, 0], [-1, 1], [0, 0]], #[[0, -1], [0, 0], [0, 1], [0, 0]]
-                #none for yellow
-                ':yellow_square:': [[0, 0], [0, 0], [0, 0], [0, 0]],
-                #green: right 1, nothing, right 1, nothing
-                ':green_square:': [[0, 0], [0, 0], [0, 0], [0, 0]], #[[0, 1], [0, 0], [0, 1], [0, 0]]
-                #purple: nothing, right 1, left 1 (possibly up too), right 1
-                ':purple_square:': [[0, 0], [1, 1], [0, -1], [0, 1]], #[[0, 0], [0, 1], [0, -1], [0, 1]]
-                #red: left 1, up 1, right 1, up 1
-                ':red_square:': [[1, -1], [-1, -1], [0, 2], [-1, -1]] #[[0, -1], [-1, 0], [0, 1], [-1, 0]]
-                }
-
-#starting spots, right above the board ready to be lowered. Col is 3/4 to start in middle
-shape_I = Tetronimo([[0, 3], [0, 4], [0, 5], [0, 6]], blue_square, [1, 1, 1, 1])
-shape_J = Tetronimo([[0, 3], [0, 4], [0, 5], [-1, 3]], brown_square, [1, 1, 2, 2])
-shape_L = Tetronimo([[0, 3], [0, 4], [0, 5], [-1, 5]], orange_square, [1, 2, 2, 1])
-shape_O = Tetronimo([[0, 4], [0, 5], [-1, 4], [-1, 5]], yellow_square, [1, 1, 1, 1])
-shape_S = Tetronimo([[0, 3], [0, 4], [-1, 4], [-1, 5]], green_square, [2, 2, 2, 2])
-shape_T = Tetronimo([[0, 3], [0, 4], [0, 5], [-1, 4]], purple_square, [1, 1, 3, 0])
-shape_Z = Tetronimo([[0, 4], [0, 5], [-1, 3], [-1, 4]], red_square, [0, 1, 0, 2])
-
-
-#fill board with empty squares
-def make_empty_board():
-    for row in range(num_of_rows):
-        board.append([])
-        for col in range(num_of_cols):
-            board[row].append(empty_square)
-
-def fill_board(emoji):
-    for row in range(num_of_rows):
-        for col in range(num_of_cols):
-            if board[row][col] != emoji:
-                board[row][col] = emoji
-
-
-def format_board_as_str():
-    board_as_str = ''
-    for row in range(num_of_rows):
-        for col in range(num_of_cols):
-            board_as_str += (board[row][col]) # + " " possibly
-            if col == num_of_cols - 1:
-                board_as_str += "\n "
-    return board_as_str
-
-def get_random_shape():
-    global index
-    # ordered_shapes = [shape_J, shape_T, shape_L, shape_O, shape_S, shape_Z, shape_S, shape_T, shape_J, shape_Z, shape_S, shape_I, shape_Z, shape_O, shape_T, shape_J, shape_L, shape_Z, shape_I]
-    # random_shape = ordered_shapes[index]
-    shapes = [shape_I, shape_J, shape_L, shape_O, shape_S, shape_T, shape_Z]
-    random_shape = shapes[random.randint(0, 6)] #0, 6
-    index += 1
-    if start_higher == True:
-        for s in random_shape.starting_pos[:]: #for each square
-            s[0] = s[0] - 1 #make row 1 above
-    else:
-        starting_pos = random_shape.starting_pos[:]
-    random_shape = [random_shape.starting_pos[:], random_shape.colour, random_shape.rotation_points] #gets starting point of shapes and copies, doesn't change them
-    global is_new_shape
-    is_new_shape = True
-    return random_shape #returns array with starting pos and colour
 
-def do_wall_kicks(shape, old_shape_pos, shape_colour, attempt_kick_num):
-    new_shape_pos = []
 
-    if shape_colour == blue_square:
-        kick_set = main_wall_kicks[rotation_pos]
-    else:
-        kick_set = i_wall_kicks[rotation_pos]
-
-    print('Kick set: ' + str(kick_set))
-    for kick in kick_set:
-        print('Kick: ' + str(kick))
-        for square in shape:
-            square_row = square[0]
-            square_col = square[1]
-            new_square_row = square_row + kick[0]
-            new_square_col = square_col + kick[1]
-            if (0 <= new_square_col < num_of_cols) and (0 <= new_square_row < num_of_rows): #if square checking is on board
-                square_checking = board[new_square_row][new_square_col] #get the square to check if empty
-                if (square_checking != empty_square) and ([new_square_row, new_square_col] not in old_shape_pos): #if square is not empty / won't be when other parts of shape have moved
-                    #shape doesn't fit
-                    new_shape_pos = [] #reset new_shape
-                    break
-                else: #shape does fit
-                    new_shape_pos.append([new_square_row, new_square_col]) #store pos
-                    print('New shape: ' + str(new_shape_pos))
-                    if len(new_shape_pos) == 4:
-                        print('Returned new shape after doing kicks')
-                        return new_shape_pos #return shape with kicks added
-            else:
-                #shape doesn't fit
-                new_shape_pos = [] #reset new_shape
+class TetrisSession(tetris.TetrisGame):
+    """ A game of Tetris in a Discord message, so any number of games can run at once
+        Sessions are stored in `sessions` by the id of their game message
+    """
+    __slots__ = ('msg', 'user_id', 'task', 'inputs', 'log', 'starting')
+
+    def __init__(self, msg, user_id):
+        self.msg = msg #the game message, its reactions or buttons are the controls
+        self.user_id = user_id #only this user can control the game
+        self.task = None #task running run_game()
+        self.inputs = asyncio.Queue(maxsize=max_queued_inputs) #('left', 'right', 'down' or 'rotate', interaction, time.perf_counter()), drained every tick
+        self.log = tetris.ReplayLog() #replay records not written to disk yet
+        self.starting = False #▶ was pressed and the message is being set up for the game
+        super().__init__()
+
+    def playing(self):
+        """ True from the moment ▶ is pressed until the game is over """
+        return self.starting or (self.task is not None and not self.task.done())
+
+    def format_frame(self):
+        """ The board with the falling shape, and the next shape under it """
+        return self.format_board_as_str() + "\n Next:\n " + tetris.format_preview(self.next_shape())
+
+
+# All running games, by the id of their game message
+sessions = {}
+
+# Seconds between two frames of a game, also keeps the message edits under the api rate limit
+tick_interval = 1.0
+
+tick_seconds = metrics.Histogram('tetris_tick_seconds', 'Time one tick and building its frame take', metrics.tick_buckets)
+frame_seconds = metrics.Histogram('tetris_frame_send_seconds', 'Round trip of sending a frame, by msg.edit or as the answer to a button press', metrics.api_buckets, label='via')
+input_seconds = metrics.Histogram('tetris_input_to_frame_seconds', 'From a reaction or button press until the frame with it was sent', metrics.api_buckets)
+frames_total = metrics.Counter('tetris_frames_total', 'Frames sent, or skipped because nothing changed', label='result')
+api_requests = metrics.Counter('discord_api_requests_total', 'Requests made through the discord.py http client, interaction responses not included', label='route')
+metrics.Gauge('tetris_sessions', 'Game messages that have a session', lambda: len(sessions))
+metrics.Gauge('tetris_running_games', 'Sessions with a game in progress', lambda: sum(1 for session in sessions.values() if session.task is not None and not session.task.done()))
+
+# With "profile_games": true in config.json every tick runs under cProfile,
+# the result is on /profile next to /metrics
+game_profiler = cProfile.Profile() if config.get("profile_games") else None
+
+
+class FrameRenderer:
+    """ Edits the game message with a new frame, but only if it looks different to the last one """
+    __slots__ = ('msg', 'last_frame', 'edits', 'skipped')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.last_frame = None
+        self.edits = 0
+        self.skipped = 0 #frames that didn't change and weren't sent
+
+    async def show(self, frame, interaction=None):
+        """ Sends the frame, as the answer to a button press if there is one """
+        if frame == self.last_frame:
+            self.skipped += 1
+            frames_total.inc('skipped')
+            if interaction is not None:
+                await defer_quietly(interaction)
+            return False
+        embed = discord.Embed(description=frame, color=embed_colour)
+        if interaction is None or not await self.answer(interaction, embed):
+            # discord.py reads the rate limit headers of every response and holds
+            # this call back until the bucket has room again, so all games share
+            # the budget without a fixed sleep
+            with frame_seconds.time('edit'):
+                await self.msg.edit(embed=embed)
+        frames_total.inc('sent')
+        self.last_frame = frame
+        self.edits += 1
+        return True
+
+    async def answer(self, interaction, embed):
+        """ Sends the frame as the answer to a button press, False if the press
+            can't be answered anymore (its 3 seconds ran out while this game
+            was waiting for the rate limit)
+        """
+        try:
+            with frame_seconds.time('interaction'):
+                await interaction.response.edit_message(embed=embed)
+            return True
+        except discord.HTTPException:
+            return False
+
+
+async def defer_quietly(interaction):
+    """ Acknowledges a button press, a press that is too old to be answered is ignored """
+    try:
+        await interaction.response.defer()
+    except discord.HTTPException:
+        pass
+
+
+async def run_game(session):
+    """ Game loop of one session, runs until game over or until its task is cancelled with ❌
+        One tick per tick_interval, measured from the start of each tick so the
+        time msg.edit() takes doesn't slow the game down. Every input that came
+        in during a tick ends up in the same frame, and frames that didn't
+        change aren't sent at all.
+    """
+    loop = asyncio.get_running_loop()
+    renderer = FrameRenderer(session.msg)
+    inputs = session.inputs
+    next_tick = loop.time()
+    while True:
+        #everything the player pressed since the last tick, in order
+        events = []
+        interactions = [] #button presses waiting for an answer
+        first_input = None #when the oldest of the inputs came in
+        while not inputs.empty():
+            event, interaction, pressed = inputs.get_nowait()
+            events.append(event)
+            if interaction is not None:
+                interactions.append(interaction)
+            if first_input is None:
+                first_input = pressed
+
+        started = time.perf_counter()
+        if game_profiler is not None:
+            game_profiler.enable()
+        session.tick(events)
+        session.log.tick(events, loop.time())
+        frame = None if session.game_over else session.format_frame()
+        if game_profiler is not None:
+            game_profiler.disable()
+        tick_seconds.observe(time.perf_counter() - started)
+        tick_log.debug("game %s: %d inputs, shape %s at %d,%d", session.msg.id, len(events), session.shape.code, session.shape_row, session.shape_col)
+        if session.log.ticks >= replay_flush_ticks:
+            save_replay(session) #written in the background, the tick doesn't wait for it
+
+        if session.game_over:
+            for interaction in interactions:
+                run_in_background(defer_quietly(interaction))
+            break
+
+        #Update board, the first button press of this tick is answered with the frame
+        await renderer.show(frame, interactions[0] if interactions else None)
+        if first_input is not None:
+            input_seconds.observe(time.perf_counter() - first_input)
+        for interaction in interactions[1:]:
+            run_in_background(defer_quietly(interaction))
+        now = loop.time()
+        if session.is_new_shape:
+            next_tick = now #show a new shape right away
+        else:
+            next_tick += tick_interval
+            if next_tick < now - tick_interval:
+                next_tick = now #the edit was held back by the rate limit, don't rush the missed ticks
+            await asyncio.sleep(max(0, next_tick - now))
+
+    msg = session.msg
+
+    tetris_log.info("game over in %s: %d points, %d lines", msg.id, session.points, session.lines)
+    session.log.end(session.points, session.lines)
+    save_replay(session)
+    desc = 'Score: {} \n Lines: {} \n \n Press ▶ to play again.'.format(session.points, session.lines)
+    embed = discord.Embed(title='GAME OVER', description=desc, color=embed_colour)
+    await msg.edit(embed=embed)
+    if tetris_controls == "buttons":
+        return #the buttons stay, ▶ starts the next game
+    await msg.remove_reaction("⬅", client.user) #Left
+    await msg.remove_reaction("⬇", client.user) #Down
+    await msg.remove_reaction("➡", client.user) #Right
+    await msg.remove_reaction("🔃", client.user) #Rotate
+    await msg.add_reaction("▶") #Play
+
+
+async def main():
+    global token
+    botlog.setup(config.get("log_level", "INFO"), config.get("bot_log_level"))
+    async with client:
+        while True:
+            try:
+                # Logs in and validates the token in one request
+                await client.login(token)
                 break
+            except discord.LoginFailure:
+                # If the token is incorrect, an error will be printed
+                # You will then be asked to enter a token again (while Loop)
+                print(f"\nSeems like you entered an {Fore.RED}invalid token{Fore.RESET}. Please enter a valid token (see Github repo for help).")
+
+                # Forgets the stored token so that it isn't used again, the rest of the config stays
+                config.pop("token", None)
+                token = await asyncio.get_running_loop().run_in_executor(None, input, "> ")
+            except aiohttp.ClientConnectionError:
+                exit(f"{Fore.RED}ConnectionError{Fore.RESET}: Discord is commonly blocked on public networks, please make sure discord.com is reachable!")
+            except asyncio.TimeoutError:
+                exit(f"{Fore.RED}Timeout{Fore.RESET}: Connection to Discord's API has timed out (possibly being rate limited?)")
+
+        save_config()
+        print(f"> logged in after {time.perf_counter() - start_time:.2f}s")
+        await client.connect()
+
+# Only when the script is started, the tests import it without logging in
+if __name__ == '__main__':
+    # inspect.cleandoc() is used to remove the indentation from the message
+    # when using triple quotes (makes the code much cleaner)
+    # Typicly developers woudln't use cleandoc rather they move the text
+    # all the way to the left
+    print(inspect.cleandoc(f"""
+        Hey, welcome to the active developer badge bot.
+        Please enter your bot's token below to continue.
 
-    print('Returned old, unrotated shape')
-    return old_shape_pos #return shape without rotation
-
-
-def rotate_shape(shape, direction, rotation_point_index, shape_colour):
-    rotation_point = shape[rotation_point_index] #coords of rotation point
-    new_shape = [] #to store coords of rotated shape
-
-    #Rotate shape
-    for square in shape:
-        square_row = square[0]
-        square_col = square[1]
-        if direction == 'clockwise':
-            new_square_row = (square_col - rotation_point[1]) + rotation_point[0] + rot_adjustments.get(shape_colour)[rotation_pos-1][0]
-            print('Adjustment made: ' + str(rot_adjustments.get(shape_colour)[rotation_pos-1][0]))
-            new_square_col = -(square_row - rotation_point[0]) + rotation_point[1] + rot_adjustments.get(shape_colour)[rotation_pos-1][1]
-            print('Adjustment made: ' + str(rot_adjustments.get(shape_colour)[rotation_pos-1][1]))
-        elif direction == 'anticlockwise': #currently not a thing
-            new_square_row = -(square_col - rotation_point[1]) + rotation_point[0]
-            new_square_col = (square_row - rotation_point[0]) + rotation_point[1]
-        new_shape.append([new_square_row, new_square_col]) #store pos of rotated square
-        if (0 <= square_col < num_of_cols) and (0 <= square_row < num_of_rows): #if on board
-            board[square_row][square_col] = empty_square #make empty old square pos
-
-    new_shape = do_wall_kicks(new_shape, shape, shape_colour, 0) #offset shape
-
-    new_shape = sorted(new_shape, key=lambda l:l[0], reverse=True) #sort so that bottom squares are first in list
-    print('Rotated shape: ' + str(new_shape))
-
-    #Place rotated shape (in case can't move down)
-    if new_shape != shape: #if not same as old unrotated shape (in case places at start pos)
-        for square in new_shape:
-            square_row = square[0]
-            square_col = square[1]
-            board[square_row][square_col] = shape_colour
-
-    return new_shape
-
-def clear_lines():
-    global board
-    global points
-    global lines
-    lines_to_clear = 0
-    for row in range(num_of_rows):
-        row_full = True #assume line is full
-        for col in range(num_of_cols):
-            if board[row][col] == empty_square:
-                row_full = False
-                break #don't clear this row
-        if row_full: #if line to clear
-            lines_to_clear += 1
-            #bring all lines above down
-            board2 = board[:] #clone board
-            for r in range(row, 0, -1): #for every row above row
-                if r == 0: #if top row
-                    for c in range(num_of_cols):
-                        board2[r][c] = empty_square #make each spot empty
-                else:
-                    for c in range(num_of_cols):
-                        board2[r][c] = board[r - 1][c] #make each spot the one above
-            board = board2[:]
-    if lines_to_clear == 1:
-        points += 100
-        lines += 1
-    elif lines_to_clear == 2:
-        points += 300
-        lines += 2
-    elif lines_to_clear == 3:
-        points += 500
-        lines += 3
-    elif lines_to_clear == 4:
-        points += 800
-        lines += 4
-
-
-def get_next_pos(cur_shape_pos):
-    global h_movement
-    global start_higher
-    global game_over
-
-    #Check if new pos for whole shape is available
-    movement_amnt = 1
-
-    if down_pressed == False:
-        amnt_to_check = 1 #check space one below
-    else:
-        amnt_to_check = num_of_rows #check all rows until furthest available space
-
-    for i in range(amnt_to_check):
-        square_num_in_shape = -1
-        for square in cur_shape_pos:
-            next_space_free = True
-            square_num_in_shape += 1
-            square_row = square[0]
-            square_col = square[1]
-            if (0 <= square_col < num_of_cols): #if current column spot will fit
-                if not (0 <= square_col + h_movement < num_of_cols): #if spot with column position changed won't fit
-                    h_movement = 0 #just change row position
-                if (0 <= square_row + movement_amnt < num_of_rows): #if new square row pos is on board
-                    square_checking = board[square_row + movement_amnt][square_col + h_movement] #get the square to check if empty
-                    if (square_checking != empty_square) and ([square_row + movement_amnt, square_col + h_movement] not in cur_shape_pos): #if square is not empty / won't be when other parts of shape have moved
-                        #check if space free if not moving horizontally (in case going into wall) but still going down
-                        h_movement = 0
-                        square_checking = board[square_row + movement_amnt][square_col + h_movement]
-                        if (square_checking != empty_square) and ([square_row + movement_amnt, square_col + h_movement] not in cur_shape_pos):
-                            if movement_amnt == 1:
-                                next_space_free = False #can't put shape there
-                                print('Detected a space that isnt free')
-                                print('Square checking: ' + str(square_row + movement_amnt) + ', ' + str(square_col + h_movement))
-                                if is_new_shape: #if can't place new shape
-                                    if start_higher == True:
-                                        game_over = True
-                                    else:
-                                        start_higher = True
-                            elif movement_amnt > 1: #if sending down
-                                movement_amnt -= 1 #accomodate for extra 1 added to check if its free
-                            return [movement_amnt, next_space_free] #stop checking
-                    elif down_pressed == True:
-                        if square_num_in_shape == 3: #only on last square in shape
-                            movement_amnt += 1 #increase amount to move shape by
-                elif square_row + movement_amnt >= num_of_rows: #new square row isn't on board
-                    if movement_amnt == 1:
-                        next_space_free = False #can't put shape there
-                        print('Detected a space that isnt free')
-                    elif movement_amnt > 1: #if sending down
-                        movement_amnt -= 1 #accomodate for extra 1 added to check if its free
-                    return [movement_amnt, next_space_free] #stop checking
-                elif down_pressed == True:
-                    if square_num_in_shape == 3: #only on last square in shape
-                        movement_amnt += 1 #increase amount to move shape by
-
-    return [movement_amnt, next_space_free]
-
-
-async def run_game(msg, cur_shape):
-    global command_in_use
-    global is_new_shape
-    global h_movement
-    global rotate_clockwise
-    global rotation_pos
-
-    cur_shape_pos = cur_shape[0]
-    cur_shape_colour = cur_shape[1]
-
-    if rotate_clockwise == True and cur_shape_colour != yellow_square:
-        cur_shape_pos = rotate_shape(cur_shape_pos, 'clockwise', cur_shape[2][rotation_pos], cur_shape_colour) #rotate shape
-        cur_shape = [cur_shape_pos, cur_shape_colour, cur_shape[2]] #update shape
-
-    next_pos = get_next_pos(cur_shape_pos)[:]
-    movement_amnt = next_pos[0]
-    next_space_free = next_pos[1]
-
-    #move/place shape if pos is available
-    square_num_in_shape = -1
-    if next_space_free:
-        for square in cur_shape_pos:
-            square_num_in_shape += 1
-            square_row = square[0]
-            square_col = square[1]
-            if (0 <= square_row + movement_amnt < num_of_rows): #if new square row pos is on board
-                square_changing = board[square_row + movement_amnt][square_col + h_movement] #get square to change
-                board[square_row + movement_amnt][square_col + h_movement] = cur_shape_colour #changes square colour to colour of shape
-                if is_new_shape == True:
-                    is_new_shape = False #has been placed, so not new anymore
-                if square_row > -1: #stops from wrapping around list and changing colour of bottom rows.
-                    board[square_row][square_col] = empty_square #make old square empty again
-                cur_shape_pos[square_num_in_shape] = [square_row + movement_amnt, square_col + h_movement] #store new pos of shape square
-            else: #if new square row pos is not on board
-                cur_shape_pos[square_num_in_shape] = [square_row + movement_amnt, square_col + h_movement] #store new pos of shape square
-    else:
-        global down_pressed
-        down_pressed = False #reset it
-        clear_lines() #check for full lines and clear them
-        cur_shape = get_random_shape() #change shape
-        rotation_pos = 0 #reset rotation
-        print('Changed shape.')
-
-    if not game_over:
-        #Update board
-        embed = discord.Embed(description=format_board_as_str(), color=embed_colour)
-        h_movement = 0 #reset horizontal movement
-        rotate_clockwise = False #reset clockwise rotation
-        await msg.edit(embed=embed)
-        if not is_new_shape:
-            await asyncio.sleep(1) #to keep under api rate limit
-        await run_game(msg, cur_shape)
+        {Style.DIM}Don't close this application after entering the token
+        You may close it after the bot has been invited and the command has been ran{Style.RESET_ALL}
+    """))
+
+    if token:
+        print(f"\n--- Detected token in {Fore.GREEN}./config.json{Fore.RESET} (saved from a previous run). Using stored token. ---\n")
     else:
-        print('GAME OVER')
-        desc = 'Score: {} \n Lines: {} \n \n Press ▶ to play again.'.format(points, lines)
-        embed = discord.Embed(title='GAME OVER', description=desc, color=embed_colour)
-        await msg.edit(embed=embed)
-        await msg.remove_reaction("⬅", client.user) #Left
-        await msg.remove_reaction("⬇", client.user) #Down
-        await msg.remove_reaction("➡", client.user) #Right
-        await msg.remove_reaction("🔃", client.user) #Rotate
-        await msg.add_reaction("▶") #Play
-        command_in_use = False
-
-
-async def reset_game():
-    global down_pressed
-    global rotate_clockwise
-    global rotation_pos
-    global h_movement
-    global is_new_shape
-    global start_higher
-    global game_over
-    global next_space_free
-    global points
-    global lines
-    fill_board(empty_square)
-    down_pressed = False
-    rotate_clockwise = False
-    rotation_pos = 0
-    h_movement = 0 #amount to move left or right
-    is_new_shape = False
-    start_higher = False
-    game_over = False
-    next_space_free = True
-    points = 0
-    lines = 0
-
-make_empty_board()
-
-
-# Runs the bot with the token you provided
-client.run(token)
\ No newline at end of file
+        # Take input from the user if no token is detected
+        token = input("> ")
+
+    # Runs the bot with the token you provided
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
@@ -0,0 +1,86 @@
+import atexit
+import logging
+import queue
+import time
+
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging that never blocks the event loop. Loggers only put the record on a
+# queue, a QueueListener thread formats it and writes it to the console, so
+# a slow terminal or log collector can't hold up the games.
+# Debug calls are cheap when debug is off: the level is checked before
+# anything is formatted, always pass the values as arguments
+# (log.debug("tick %s", n)), never as an f-string.
+
+# Same layout as discord.py's own log lines
+log_format = '[{asctime}] [{levelname:<8}] {name}: {message}'
+date_format = '%Y-%m-%d %H:%M:%S'
+
+
+class LoopQueueHandler(QueueHandler):
+    """ Puts records on the queue as they are, the message is only built in the listener thread
+
+        QueueHandler formats every record before queueing it, so that it can
+        be sent to another process. The queue here stays in this process, so
+        that work can wait for the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup(level=logging.INFO, bot_level=None, formatter=None):
+    """ Sends every log record through a queue to a console handler on its own thread
+        level is for all loggers (discord.py too), bot_level for the "bosco" loggers of the bot
+        Returns the listener, it is stopped when python exits
+    """
+    records = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(formatter or logging.Formatter(log_format, date_format, style='{'))
+    listener = QueueListener(records, console, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LoopQueueHandler(records))
+    root.setLevel(level)
+    if bot_level is not None:
+        logging.getLogger('bosco').setLevel(bot_level)
+
+    listener.start()
+    atexit.register(listener.stop) #writes what is left in the queue
+    return listener
+
+
+class RateLimitedLog:
+    """ Debug logging for things that happen on every tick
+
+        At most rate records per second get through (with bursts of up to
+        burst), the rest are counted and the next record that gets through
+        says how many were dropped. With debug off a call is one level check.
+    """
+    __slots__ = ('logger', 'rate', 'burst', 'tokens', 'last', 'dropped')
+
+    def __init__(self, logger, rate=10, burst=None):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.dropped = 0
+
+    def debug(self, msg, *args):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return
+        self.tokens -= 1
+        if self.dropped:
+            msg += ' (%d more dropped)'
+            args += (self.dropped,)
+            self.dropped = 0
+        self.logger.debug(msg, *args)
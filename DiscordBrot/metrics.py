@@ -0,0 +1,164 @@
+import bisect
+import io
+import threading
+import time
+
+# Counters and latency histograms for the hot paths of the bot, shown in the
+# Prometheus text format. Recording a value is a lock and a few additions,
+# so it is cheap enough for every Tetris tick. Values can be recorded from
+# executor threads too, the pdf renderer does that.
+# serve() makes them available on http://127.0.0.1:<port>/metrics, nothing
+# is served unless "metrics_port" is set in config.json.
+
+# Every metric that was created, in the order they are shown
+registry = []
+
+# Bucket bounds in seconds
+tick_buckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+api_buckets = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+stage_buckets = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label, value):
+    if label is None:
+        return ''
+    return '{%s="%s"}' % (label, escape(value))
+
+
+class Counter:
+    """ A number that only goes up, optionally split by the value of one label """
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: str(item[0]))
+        for label_value, value in values:
+            lines.append(f"{self.name}{format_labels(self.label, label_value)} {value}")
+        return lines
+
+
+class Gauge:
+    """ A value that is read when the metrics are shown, from a function that returns it """
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+        registry.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    """ Counts values (seconds) into buckets, optionally split by the value of one label """
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.series = {} #label value -> [bucket counts..., count in +Inf, sum]
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, label_value=None):
+        """ with histogram.time(): ... records how long the block took """
+        return Timer(self, label_value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted(((label_value, list(values)) for label_value, values in self.series.items()), key=lambda item: str(item[0]))
+        for label_value, values in series:
+            prefix = '' if self.label is None else '%s="%s",' % (self.label, escape(label_value))
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                total += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {total}')
+            lines.append(f"{self.name}_sum{format_labels(self.label, label_value)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.label, label_value)} {total}")
+        return lines
+
+
+class Timer:
+    __slots__ = ('histogram', 'label_value', 'start')
+
+    def __init__(self, histogram, label_value):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.label_value)
+
+
+def render():
+    """ All metrics in the Prometheus text format """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def profile_report(profiler, limit=40):
+    """ The functions that took the most time in a cProfile.Profile, as text """
+    import pstats
+
+    out = io.StringIO()
+    try:
+        stats = pstats.Stats(profiler, stream=out)
+    except TypeError:
+        return "nothing profiled yet\n"
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+async def serve(port, host='127.0.0.1', profiler=None):
+    """ Serves /metrics, and /profile if a profiler is given, until the bot stops
+        Returns the aiohttp runner, call runner.cleanup() to stop it
+    """
+    from aiohttp import web
+
+    async def show_metrics(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    async def show_profile(request):
+        return web.Response(text=profile_report(profiler), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', show_metrics)
+    if profiler is not None:
+        app.router.add_get('/profile', show_profile)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,179 @@
+import json
+import os
+
+from datetime import datetime, timedelta, timezone
+
+# When the weekly menu run happens, as a cron line ("0 6 * * 1" is Monday
+# 06:00) in a time zone. The time of the last successful run and the next
+# one that is due are kept in a json file, so a restart doesn't run again
+# what already ran, and a run that was missed while the bot was down is
+# done once after it starts. The messages a run posted are kept there too,
+# the next run deletes them even if the bot was restarted in between.
+
+state_file = 'menu_schedule.json'
+
+weekday_names = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+month_names = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+
+
+def parse_field(text, low, high, names=None):
+    """ One cron field ("*", "1-5", "*/15", "mon,wed", ...) as a sorted tuple of the values it allows """
+    values = set()
+    for part in text.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (parse_value(value, names) for value in part.split('-'))
+        else:
+            start = end = parse_value(part, names)
+            if step != 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"{text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return tuple(sorted(values))
+
+
+def parse_value(text, names):
+    if names and text in names:
+        return names[text]
+    return int(text)
+
+
+class Cron:
+    """ A cron line: minute hour day-of-month month day-of-week
+
+        Like cron, when both day-of-month and day-of-week are given a day
+        matches if either of them does. Day-of-week 0 and 7 are Sunday.
+    """
+
+    def __init__(self, text):
+        fields = text.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron line {text!r} needs 5 fields: minute hour day-of-month month day-of-week")
+        self.text = text
+        self.minutes = parse_field(fields[0], 0, 59)
+        self.hours = parse_field(fields[1], 0, 23)
+        self.days = parse_field(fields[2], 1, 31)
+        self.months = parse_field(fields[3], 1, 12, month_names)
+        self.weekdays = frozenset(day % 7 for day in parse_field(fields[4], 0, 7, weekday_names))
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches_day(self, day):
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next(self, after, tz=timezone.utc):
+        """ The first time after `after` (an aware datetime) that matches, in tz """
+        local = after.astimezone(tz)
+        day = local.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(366 * 5): #every day of the week/month combination comes up within a few years
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        when = day.replace(hour=hour, minute=minute, tzinfo=tz)
+                        if when.timestamp() > after.timestamp():
+                            return when
+            day += timedelta(days=1)
+        raise ValueError(f"cron line {self.text!r} never matches")
+
+
+def load_timezone(name):
+    """ The zoneinfo time zone, or None for local time if it isn't known
+        (Windows only knows them with the tzdata package installed, and
+        zoneinfo is new in Python 3.9)
+    """
+    if not name:
+        return None
+    try:
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    except ImportError:
+        return None
+
+    try:
+        return ZoneInfo(name)
+    except ZoneInfoNotFoundError:
+        return None
+
+
+class Schedule:
+    """ The cron line, the time zone and the saved state of a repeating job """
+
+    def __init__(self, cron, tz=None, path=state_file):
+        self.cron = cron if isinstance(cron, Cron) else Cron(cron)
+        self.tz = tz or datetime.now().astimezone().tzinfo
+        self.path = path
+        self.last_run = None
+        self.next_due = None
+        self.posted = [] #[channel id, message id] of the messages the last run posted
+        self.posted_until = None #when they are replaced, after that they can go
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        #the posted messages have to go whatever the schedule is now
+        self.posted = state.get('posted', [])
+        self.posted_until = state.get('posted_until') and datetime.fromisoformat(state['posted_until'])
+        if state.get('cron') != self.cron.text:
+            return #the schedule changed, the saved due time doesn't count anymore
+        self.last_run = state.get('last_run') and datetime.fromisoformat(state['last_run'])
+        self.next_due = state.get('next_due') and datetime.fromisoformat(state['next_due'])
+
+    def save(self):
+        state = {
+            'cron': self.cron.text,
+            'last_run': self.last_run and self.last_run.isoformat(),
+            'next_due': self.next_due and self.next_due.isoformat(),
+            'posted': self.posted,
+            'posted_until': self.posted_until and self.posted_until.isoformat(),
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def due(self, now=None):
+        """ When the job has to run next, a time in the past means a run was missed
+            Without saved state the first run is the next matching time, not now
+        """
+        if self.next_due is None:
+            self.next_due = self.cron.next(now or datetime.now(timezone.utc), self.tz)
+            self.save()
+        return self.next_due
+
+    def upcoming(self, now=None):
+        """ The next matching time after now, whatever the saved state says """
+        return self.cron.next(now or datetime.now(timezone.utc), self.tz)
+
+    def done(self, now=None):
+        """ Saves a successful run and works out the next one """
+        now = now or datetime.now(timezone.utc)
+        self.last_run = now
+        self.next_due = self.cron.next(now, self.tz)
+        self.save()
+        return self.next_due
+
+    def add_posted(self, channel_id, message_id, until):
+        """ Saves a message the run posted, it stays up until `until` (an aware datetime) """
+        self.posted.append([channel_id, message_id])
+        self.posted_until = until
+        self.save()
+
+    def clear_posted(self):
+        self.posted = []
+        self.posted_until = None
+        self.save()
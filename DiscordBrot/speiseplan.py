@@ -0,0 +1,557 @@
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import metrics
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking helpers for the weekly Speiseplan run.
+# Everything in here touches the disk, the network or poppler, so the bot
+# never calls these directly on the event loop. pdf_loop hands them to an
+# executor with loop.run_in_executor() instead.
+# gdown, requests and pdf2image are only needed once a day, so they are
+# imported inside the functions that use them to keep the bot start fast.
+
+folder = 'Speiseplan'
+drive_url = "https://drive.google.com/drive/folders/1WB5lNSE901jWigIAk0dgxKIG-ljaSzQO"
+popplerpath = r'poppler-23.11.0\Library\bin'
+cache_folder = 'Speiseplan_cache'
+manifest_name = 'manifest.json'
+text_index_name = 'Speiseplan_index.json'
+
+# sync and upload are timed by pdf_loop, render and encode in render_pdf()
+stage_seconds = metrics.Histogram('speiseplan_stage_seconds', 'Time each step of the menu run takes, per pdf for render and encode', metrics.stage_buckets, label='stage')
+
+
+def parse_folder_page(html):
+    """ Reads the file list out of the html of a google drive folder page
+        Returns a list of {'id', 'name', 'size', 'modified'} dicts for the pdfs, sorted by name
+    """
+    match = re.search(r"window\['_DRIVE_ivd'\] = '(.*?)';", html)
+    if match is None:
+        raise ValueError('no file list found in the google drive folder page')
+    #the list is a javascript string literal, \xNN and \/ have to be unescaped before it is valid json
+    encoded = re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), match.group(1))
+    data = json.loads(encoded.replace('\\/', '/'))
+    files = []
+    for item in data[0] or []:
+        if item[3] == 'application/pdf' or item[2].endswith('.pdf'):
+            files.append({'id': item[0], 'name': item[2], 'size': item[13], 'modified': item[9]})
+    return sorted(files, key=lambda f: f['name'])
+
+
+def list_folder(url=drive_url):
+    """ Lists the pdfs in the google drive folder without downloading them """
+    import requests
+
+    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
+    response.raise_for_status()
+    return parse_folder_page(response.text)
+
+
+def download_file(file_id, output):
+    """ Downloads a single drive file """
+    import gdown
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    return gdown.download(id=file_id, output=output, quiet=True, use_cookies=False)
+
+
+def load_manifest(path=folder):
+    """ Returns the {file id: entry} manifest of the last sync """
+    try:
+        with open(os.path.join(path, manifest_name)) as f:
+            return {entry['id']: entry for entry in json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def sync_folder(listing, path=folder, fetch=download_file):
+    """ Makes path match the drive listing, downloading only new or changed pdfs
+
+        A file counts as changed when its name, size or modified time differ
+        from the manifest of the last sync. The new state is built in a temp
+        folder and renamed into place at the end, so a failed download leaves
+        the previous menu untouched.
+        Returns (manifest entries sorted by name, added, changed, removed names)
+    """
+    manifest = load_manifest(path)
+    listed_ids = {entry['id'] for entry in listing}
+    added, changed, unchanged = [], [], []
+    for entry in listing:
+        previous = manifest.get(entry['id'])
+        if previous is None:
+            added.append(entry)
+        elif (previous['name'], previous['size'], previous['modified']) != (entry['name'], entry['size'], entry['modified']) \
+                or not os.path.isfile(os.path.join(path, previous['name'])):
+            changed.append(entry)
+        else:
+            unchanged.append(previous)
+    removed = [entry['name'] for file_id, entry in manifest.items() if file_id not in listed_ids]
+
+    if not added and not changed and not removed:
+        return sorted(unchanged, key=lambda e: e['name']), [], [], []
+
+    tmp_path = path + '.tmp'
+    old_path = path + '.old'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        entries = []
+        for entry in unchanged:
+            source = os.path.join(path, entry['name'])
+            target = os.path.join(tmp_path, entry['name'])
+            try:
+                os.link(source, target) #no copy needed, the old folder is deleted afterwards
+            except OSError:
+                shutil.copy2(source, target)
+            entries.append(entry)
+        for entry in added + changed:
+            target = os.path.join(tmp_path, entry['name'])
+            fetch(entry['id'], target)
+            entries.append(dict(entry, sha256=file_hash(target)))
+        entries.sort(key=lambda e: e['name'])
+        with open(os.path.join(tmp_path, manifest_name), 'w') as f:
+            json.dump(entries, f, indent=2)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.isdir(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return entries, [e['name'] for e in added], [e['name'] for e in changed], removed
+
+
+class RenderProfile:
+    """ How a menu page is rasterised and encoded
+
+        width renders straight to that pixel width (poppler scales, so the
+        full 500 DPI page never exists in memory). Set width to None to
+        render at dpi instead. The quality is lowered in quality_step steps
+        down to min_quality until the encoded image fits into max_bytes.
+    """
+
+    def __init__(self, width=2000, dpi=200, grayscale=False, format='JPEG', quality=85,
+                 min_quality=40, quality_step=5, optimize=True, progressive=True,
+                 max_bytes=8 * 1024 * 1024):
+        self.width = width
+        self.dpi = dpi
+        self.grayscale = grayscale
+        self.format = format.upper() #JPEG or WEBP
+        self.quality = quality
+        self.min_quality = min_quality
+        self.quality_step = quality_step
+        self.optimize = optimize
+        self.progressive = progressive
+        self.max_bytes = max_bytes
+
+    @property
+    def extension(self):
+        return '.webp' if self.format == 'WEBP' else '.jpg'
+
+    def key(self):
+        """ Short fingerprint of the settings, rendered images are cached per profile """
+        settings = json.dumps(self.__dict__, sort_keys=True)
+        return hashlib.sha256(settings.encode()).hexdigest()[:12]
+
+
+default_profile = RenderProfile()
+
+
+def encode_image(image, profile=default_profile):
+    """ Encodes the PIL image with the profile and returns the bytes
+        The quality is lowered step by step until the image fits into profile.max_bytes
+    """
+    quality = profile.quality
+    while True:
+        buf = io.BytesIO()
+        if profile.format == 'WEBP':
+            image.save(buf, 'WEBP', quality=quality, method=4)
+        else:
+            image.save(buf, 'JPEG', quality=quality, optimize=profile.optimize, progressive=profile.progressive)
+        data = buf.getvalue()
+        if len(data) <= profile.max_bytes or quality - profile.quality_step < profile.min_quality:
+            return data
+        quality -= profile.quality_step
+
+
+def render_pdf(pdf_path, profile=default_profile):
+    """ Converts the first page of the pdf with the render profile and returns the encoded bytes """
+    from pdf2image import convert_from_path
+
+    size = (profile.width, None) if profile.width else None
+    with stage_seconds.time('render'):
+        pages = convert_from_path(pdf_path, profile.dpi, first_page=1, last_page=1, size=size, grayscale=profile.grayscale)
+        #pages = convert_from_path(pdf_path, profile.dpi, poppler_path=popplerpath, first_page=1, last_page=1, size=size, grayscale=profile.grayscale)
+    page = pages[0]
+    try:
+        with stage_seconds.time('encode'):
+            return encode_image(page, profile)
+    finally:
+        page.close()
+
+
+def file_hash(path):
+    """ SHA-256 of the file contents """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MenuCache:
+    """ Rendered menu images, keyed by drive file id and the SHA-256 of the pdf
+
+        The images live in the cache folder next to an index.json, so a pdf
+        that didn't change since the last run never has to be rasterised again.
+    """
+
+    def __init__(self, path=cache_folder, max_age=28 * 86400, max_bytes=500 * 1024 * 1024):
+        self.path = path
+        self.max_age = max_age #seconds since an entry was last used
+        self.max_bytes = max_bytes #total size of all cached images
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock = threading.Lock() #pdfs are rendered on several threads at once
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    @staticmethod
+    def key(file_id, digest, variant=''):
+        return f"{file_id}-{digest}-{variant}" if variant else f"{file_id}-{digest}"
+
+    def get(self, file_id, digest, variant=''):
+        """ Returns the cached image bytes or None """
+        key = self.key(file_id, digest, variant)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            image_path = os.path.join(self.path, entry['image'])
+        try:
+            with open(image_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.index.pop(key, None)
+            return None
+
+    def put(self, file_id, digest, data, extension, variant=''):
+        """ Stores a freshly rendered image in the cache """
+        key = self.key(file_id, digest, variant)
+        image = key + extension
+        with open(os.path.join(self.path, image), 'wb') as f:
+            f.write(data)
+        now = time.time()
+        with self.lock:
+            self.index[key] = {
+                'id': file_id,
+                'sha256': digest,
+                'variant': variant,
+                'image': image,
+                'size': len(data),
+                'created': now,
+                'last_used': now,
+            }
+        return os.path.join(self.path, image)
+
+    def evict(self, now=None):
+        """ Drops entries that weren't used for max_age seconds, then the least
+            recently used ones until the cache fits into max_bytes
+            Returns the removed keys
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            return self._evict(now)
+
+    def _evict(self, now):
+        removed = [k for k, e in self.index.items() if now - e['last_used'] > self.max_age]
+        total = sum(e['size'] for k, e in self.index.items() if k not in removed)
+        for k, e in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if k not in removed:
+                removed.append(k)
+                total -= e['size']
+        for k in removed:
+            entry = self.index.pop(k)
+            try:
+                os.unlink(os.path.join(self.path, entry['image']))
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp'
+        with self.lock, open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+
+def load_or_render(cache, file_id, pdf_path, profile=default_profile, digest=None):
+    """ Returns (image bytes, True if they came from the cache)
+        Unchanged pdfs are never rasterised, new ones are rendered and cached
+    """
+    digest = digest or file_hash(pdf_path)
+    data = cache.get(file_id, digest, profile.key())
+    if data is not None:
+        return data, True
+    data = render_pdf(pdf_path, profile)
+    cache.put(file_id, digest, data, profile.extension, profile.key())
+    return data, False
+
+
+# Text of the menus, for /menu. pdftotext is part of poppler like pdftoppm,
+# which pdf2image uses for the images.
+day_names = ('Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'Samstag', 'Sonntag')
+# what /menu understands as a day, besides the full names
+day_aliases = {
+    'mo': 0, 'di': 1, 'mi': 2, 'do': 3, 'fr': 4, 'sa': 5, 'so': 6,
+    'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6,
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6,
+}
+day_line = re.compile(r'^\s*(' + '|'.join(day_names) + r')\b[\s,:.-]*(?:\d{1,2}\.\s*\d{1,2}\.(?:\d{2,4})?)?[\s:-]*(.*)$', re.IGNORECASE)
+price = re.compile(r'\s*\d+[,.]\d{2}\s*(?:€|eur(?:o)?)?', re.IGNORECASE)
+allergens = re.compile(r'\s*\((?:\s*[0-9a-zA-Z]{1,3}\s*,?)+\)')
+max_dish_length = 200 #longer "dishes" are notes or footers
+
+
+def pdftotext_path():
+    if os.path.isdir(popplerpath):
+        return os.path.join(popplerpath, 'pdftotext')
+    return 'pdftotext' #from the PATH, like pdf2image finds pdftoppm
+
+
+def extract_text(pdf_path):
+    """ Text of the pdf in reading order, from poppler's pdftotext """
+    result = subprocess.run([pdftotext_path(), '-enc', 'UTF-8', '-nopgbrk', pdf_path, '-'], capture_output=True, check=True)
+    return result.stdout.decode('utf-8', errors='replace')
+
+
+def parse_menu(text):
+    """ Splits the text of a menu into {day name: [dish, ...]}
+
+        A line starting with a day name (and maybe a date) starts that day,
+        the lines up to the next day are its dishes. A dish ends at an empty
+        line, lines in between belong to the same dish. Prices and allergen
+        lists like (1,3,G) are left out. Text before the first day is the
+        title and is skipped.
+    """
+    days = {}
+    dishes = None
+    current = []
+
+    def finish_dish():
+        if dishes is not None and current:
+            dish = ' '.join(current)
+            if 2 < len(dish) <= max_dish_length:
+                dishes.append(dish)
+        current.clear()
+
+    for line in text.splitlines():
+        match = day_line.match(line)
+        if match:
+            finish_dish()
+            dishes = days.setdefault(match.group(1).capitalize(), [])
+            line = match.group(2)
+        line = allergens.sub('', price.sub('', line)).strip()
+        if not line:
+            finish_dish()
+        else:
+            current.append(line)
+    finish_dish()
+    return days
+
+
+def parse_day(text, today=None):
+    """ Index into day_names for "montag", "mo", "monday", "heute", ..., None if it isn't a day
+        today is the time.struct_time "heute" means, local time if left out
+    """
+    text = text.strip().lower()
+    if text in ('heute', 'today'):
+        return (today or time.localtime()).tm_wday
+    if text in ('morgen', 'tomorrow'):
+        return ((today or time.localtime()).tm_wday + 1) % 7
+    for number, name in enumerate(day_names):
+        if text == name.lower():
+            return number
+    return day_aliases.get(text)
+
+
+class MenuIndex:
+    """ The dishes of every pdf by day, kept in a json file next to the bot
+
+        Pdfs are keyed by drive file id and SHA-256 like the MenuCache, so
+        only new or changed ones are run through pdftotext. Lookups only
+        read the rows built from the index in memory.
+    """
+
+    def __init__(self, path=text_index_name):
+        """ path None keeps the index in memory only """
+        self.path = path
+        self.files = {}
+        if path is not None:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.files = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        self.rows = self.build_rows(self.files)
+
+    @staticmethod
+    def build_rows(files):
+        """ (day number, dish, casefolded dish) for every dish, in day and page order """
+        rows = []
+        for entry in sorted(files.values(), key=lambda entry: entry['name']):
+            for day, dishes in entry['days'].items():
+                number = day_names.index(day)
+                rows.extend((number, dish, dish.casefold()) for dish in dishes)
+        rows.sort(key=lambda row: row[0])
+        return tuple(rows)
+
+    def update(self, entries, folder=folder, extract=extract_text):
+        """ Extracts the text of new or changed pdfs and drops the ones no longer in entries
+            entries are the dicts sync_folder() returns. Returns the names of the extracted pdfs
+        """
+        files = {}
+        extracted = []
+        for entry in entries:
+            known = self.files.get(entry['id'])
+            if known is not None and known['sha256'] == entry['sha256']:
+                files[entry['id']] = known
+                continue
+            days = parse_menu(extract(os.path.join(folder, entry['name'])))
+            files[entry['id']] = {'name': entry['name'], 'sha256': entry['sha256'], 'days': days}
+            extracted.append(entry['name'])
+        # swapped in one go, lookups on the event loop never see half an update
+        self.rows = self.build_rows(files)
+        self.files = files
+        return extracted
+
+    def lookup(self, day=None, search=None):
+        """ [(day name, dish), ...] for one day (index into day_names) or all, optionally only dishes containing search """
+        search = search.casefold() if search else None
+        return [(day_names[number], dish) for number, dish, folded in self.rows
+                if (day is None or number == day) and (search is None or search in folded)]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.files, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def render_pool(workers=None):
+    """ The threads pdf_loop renders the pdfs on, one per cpu core if workers is None
+
+        pdftoppm runs as its own process for every pdf, so a thread pool is
+        enough to keep all cores busy. A process pool would have to re-import
+        the bot script on Windows, which starts a second bot.
+    """
+    return ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+def render_all(cache, pdfs, workers=None, profile=default_profile):
+    """ Runs load_or_render() for every (file id, pdf path, sha256) on a render_pool(), like pdf_loop
+        Returns the (image bytes, from cache) results in the same order
+    """
+    with render_pool(workers) as pool:
+        return list(pool.map(lambda pdf: load_or_render(cache, pdf[0], pdf[1], profile, pdf[2]), pdfs))
+
+
+def benchmark(pdf_path, count=8, workers=None, profile=default_profile):
+    """ Renders the same pdf count times through render_all(), the way pdf_loop does:
+        serially, in parallel, and once more when they are all cached
+        Returns (serial seconds, parallel seconds, cached seconds)
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        digest = file_hash(pdf_path) #pdf_loop has the hashes from the sync already
+        pdfs = []
+        for i in range(count):
+            copy = os.path.join(tmp, f"{i + 2}.pdf")
+            shutil.copyfile(pdf_path, copy)
+            pdfs.append((f"benchmark-{i}", copy, digest))
+
+        start = time.perf_counter()
+        render_all(MenuCache(os.path.join(tmp, 'serial')), pdfs, 1, profile)
+        serial = time.perf_counter() - start
+
+        cache = MenuCache(os.path.join(tmp, 'parallel'))
+        start = time.perf_counter()
+        render_all(cache, pdfs, workers, profile)
+        parallel = time.perf_counter() - start
+
+        start = time.perf_counter()
+        render_all(cache, pdfs, workers, profile)
+        cached = time.perf_counter() - start
+    return serial, parallel, cached
+
+
+def benchmark_extract(pdf_paths, lookups=10000):
+    """ Times pdftotext and parse_menu() over the pdfs, and lookups on the index built from them
+        Returns (seconds extracting, seconds parsing, seconds per lookup, dishes found)
+    """
+    texts = {}
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        texts[pdf_path] = extract_text(pdf_path)
+    extracting = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = MenuIndex(None)
+    index.update([{'id': pdf_path, 'name': pdf_path, 'sha256': ''} for pdf_path in pdf_paths], '', extract=texts.__getitem__)
+    parsing = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        index.lookup(i % 5, 'reis' if i & 1 else None)
+    lookup = (time.perf_counter() - start) / lookups
+    return extracting, parsing, lookup, len(index.rows)
+
+
+if __name__ == '__main__':
+    # python speiseplan.py menu.pdf [count] [workers]
+    # python speiseplan.py extract <pdf or folder> [...]
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'extract':
+        pdf_paths = []
+        for path in sys.argv[2:]:
+            if os.path.isdir(path):
+                pdf_paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.pdf')))
+            else:
+                pdf_paths.append(path)
+        if not pdf_paths:
+            exit("usage: python speiseplan.py extract <pdf or folder> [...]")
+        extracting, parsing, lookup, dishes = benchmark_extract(pdf_paths)
+        count = len(pdf_paths)
+        print(f"> pdftotext:  {extracting:.2f}s ({extracting / count * 1000:.1f}ms per pdf)")
+        print(f"> parsing:    {parsing * 1000:.2f}ms ({parsing / count * 1000:.2f}ms per pdf, {dishes} dishes)")
+        print(f"> lookup:     {lookup * 1000000:.1f}us per /menu query")
+        exit()
+
+    if len(sys.argv) < 2:
+        exit("usage: python speiseplan.py <pdf> [count] [workers]")
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    serial, parallel, cached = benchmark(sys.argv[1], count, workers)
+    print(f"> {count} pdfs serial:   {serial:.2f}s ({serial / count:.2f}s per pdf)")
+    print(f"> {count} pdfs parallel: {parallel:.2f}s ({parallel / count:.2f}s per pdf, {workers or os.cpu_count()} workers)")
+    print(f"> {count} pdfs cached:   {cached:.3f}s ({cached / count * 1000:.1f}ms per pdf)")
+    print(f"> speedup: {serial / parallel:.2f}x")
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules sit next to DiscordBrot.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """ The DiscordBrot module, imported without logging in
+
+        The test runs in an empty folder, so the bot finds no config.json and
+        the files it writes (cache, schedule state, replays) end up in there.
+    """
+    monkeypatch.chdir(tmp_path)
+    import DiscordBrot
+    import scheduler
+    monkeypatch.setattr(DiscordBrot, 'sessions', {})
+    monkeypatch.setattr(DiscordBrot, 'background_tasks', set())
+    monkeypatch.setattr(DiscordBrot, 'menu_schedule', scheduler.Schedule(DiscordBrot.menu_cron, DiscordBrot.menu_timezone, str(tmp_path / scheduler.state_file)))
+    return DiscordBrot
+
+
+pdf_names = ('KW 7.pdf', 'KW 8.pdf')
+
+
+def quick_render(pdf_path, profile=None):
+    return b'image of ' + os.path.basename(pdf_path).encode()
+
+
+@pytest.fixture
+def menu_channels(bot, tmp_path, monkeypatch):
+    """ A synced folder with two pdfs and two menu channels, the first one gets the uploads
+
+        Nothing goes to google drive, poppler or discord. Returns the FakeChannels.
+    """
+    import speiseplan
+    from fakes import FakeChannel
+
+    folder = tmp_path / 'Speiseplan'
+    folder.mkdir()
+    entries = []
+    for number, name in enumerate(pdf_names):
+        (folder / name).write_bytes(b'%PDF-1.4 ' + name.encode())
+        entries.append({'id': f"file-{number}", 'name': name, 'size': 10, 'modified': '0', 'sha256': f"hash-{number}"})
+
+    channels = [FakeChannel(1), FakeChannel(2)]
+    monkeypatch.setattr(speiseplan, 'folder', str(folder))
+    monkeypatch.setattr(speiseplan, 'list_folder', lambda url: entries)
+    monkeypatch.setattr(speiseplan, 'sync_folder', lambda listing, path: (listing, [], [], []))
+    monkeypatch.setattr(speiseplan, 'render_pdf', quick_render)
+    monkeypatch.setattr(bot, 'menu_cache', speiseplan.MenuCache(str(tmp_path / 'cache')))
+    monkeypatch.setattr(bot, 'menu_index', speiseplan.MenuIndex(str(tmp_path / 'index.json')))
+    monkeypatch.setattr(bot.menu_index, 'update', lambda entries, folder: []) #pdftotext isn't installed everywhere
+    monkeypatch.setattr(bot, 'menu_channels', [channel.id for channel in channels])
+    monkeypatch.setattr(bot, 'render_workers', 1)
+    monkeypatch.setattr(bot.client, 'get_channel', {channel.id: channel for channel in channels}.get)
+    return channels
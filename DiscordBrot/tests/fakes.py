@@ -0,0 +1,76 @@
+import asyncio
+import itertools
+import time
+
+from types import SimpleNamespace
+
+import discord
+
+# Stand-ins for the discord.py channels and messages the bot talks to. They
+# record what was sent instead of calling the api, and give the event loop a
+# turn on every call like a real request would.
+
+message_ids = itertools.count(1000)
+
+
+class FakeAttachment:
+    def __init__(self, message_id, filename):
+        self.filename = filename
+        self.url = f"https://cdn.discordapp.com/attachments/1/{message_id}/{filename}"
+
+
+class FakeMessage:
+    def __init__(self, channel=None, files=(), embeds=(), delete_after=None, reference=None):
+        self.id = next(message_ids)
+        self.channel = channel
+        self.files = list(files)
+        self.embeds = list(embeds)
+        self.delete_after = delete_after
+        self.reference = reference #the message this one forwards or replies to
+        self.attachments = [FakeAttachment(self.id, file.filename) for file in self.files]
+        self.edits = [] #(time.perf_counter(), embed) of every edit
+        self.deleted = False
+
+    def to_reference(self, *, fail_if_not_exists=True, type=discord.MessageReferenceType.default):
+        return SimpleNamespace(message_id=self.id, channel_id=self.channel and self.channel.id, type=type)
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(0)
+        self.edits.append((time.perf_counter(), kwargs.get('embed')))
+
+    async def delete(self):
+        await asyncio.sleep(0)
+        if self.deleted:
+            raise not_found()
+        self.deleted = True
+
+    async def add_reaction(self, emoji):
+        await asyncio.sleep(0)
+
+    async def remove_reaction(self, emoji, user):
+        await asyncio.sleep(0)
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = [] #every FakeMessage sent here
+
+    async def send(self, content=None, *, files=(), embeds=(), embed=None, delete_after=None, reference=None, **kwargs):
+        await asyncio.sleep(0)
+        msg = FakeMessage(self, files, embeds or ([embed] if embed else []), delete_after, reference)
+        self.sent.append(msg)
+        return msg
+
+    def get_partial_message(self, message_id):
+        for msg in self.sent:
+            if msg.id == message_id:
+                return msg
+        msg = FakeMessage(self)
+        msg.id = message_id
+        msg.deleted = True #never sent here, deleting it is a 404
+        return msg
+
+
+def not_found():
+    return discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), {'code': 10008, 'message': 'Unknown Message'})
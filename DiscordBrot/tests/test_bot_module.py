@@ -0,0 +1,32 @@
+import types
+
+from datetime import datetime, timedelta, timezone
+
+import tetris
+
+
+def test_commands_dont_replace_imported_modules(bot):
+    # a command function named like a module (async def tetris) rebinds the
+    # module name and everything after it that uses the module breaks
+    for name in ('asyncio', 'botlog', 'discord', 'metrics', 'scheduler', 'speiseplan', 'tetris'):
+        assert isinstance(getattr(bot, name), types.ModuleType), name
+    assert bot.tetris is tetris
+
+
+def test_tetris_command_keeps_its_name(bot):
+    command = bot.client.tree.get_command('tetris')
+    assert command is not None
+    assert command.callback is bot.tetris_command.callback
+
+
+def test_importing_doesnt_log_in(bot):
+    assert bot.client.user is None
+    assert not bot.client.is_ready()
+
+
+def test_menu_today_uses_the_menu_timezone(bot, monkeypatch):
+    # 26 hours apart, so at least one of them isn't the local day
+    for hours in (14, -12):
+        zone = timezone(timedelta(hours=hours))
+        monkeypatch.setattr(bot, 'menu_timezone', zone)
+        assert bot.menu_today().tm_wday == datetime.now(zone).weekday()
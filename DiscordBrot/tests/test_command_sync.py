@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+# Switching between global commands and a dev guild removes the commands of
+# the mode that was used before, otherwise the dev guild lists every command
+# twice (once from the guild, once from the global registration).
+
+
+def fake_discord(bot, monkeypatch):
+    """ Records syncs and removals instead of sending them, as (kind, guild id[, payload]) """
+    calls = []
+
+    async def sync(guild=None):
+        calls.append(('sync', guild and guild.id))
+
+    async def upsert_global(application_id, payload):
+        calls.append(('remove', None, payload))
+
+    async def upsert_guild(application_id, guild_id, payload):
+        calls.append(('remove', guild_id, payload))
+
+    monkeypatch.setattr(bot.client.tree, 'sync', sync)
+    monkeypatch.setattr(bot.client.http, 'bulk_upsert_global_commands', upsert_global)
+    monkeypatch.setattr(bot.client.http, 'bulk_upsert_guild_commands', upsert_guild)
+    return calls
+
+
+def read_synced():
+    with open('command_tree.json') as f:
+        return json.load(f)
+
+
+def test_switching_modes_removes_the_other_registration(bot, monkeypatch):
+    calls = fake_discord(bot, monkeypatch)
+
+    asyncio.run(bot.client.sync_commands())
+    assert calls == [('sync', None)]
+    assert list(read_synced()) == ['global']
+
+    monkeypatch.setitem(bot.config, 'dev_guild_id', '42')
+    asyncio.run(bot.client.sync_commands())
+    assert calls[1:] == [('sync', 42), ('remove', None, [])]
+    assert list(read_synced()) == ['guild:42']
+
+    asyncio.run(bot.client.sync_commands()) #restart, nothing changed
+    assert len(calls) == 3
+
+    monkeypatch.delitem(bot.config, 'dev_guild_id')
+    asyncio.run(bot.client.sync_commands())
+    assert calls[3:] == [('sync', None), ('remove', 42, [])]
+    assert list(read_synced()) == ['global']
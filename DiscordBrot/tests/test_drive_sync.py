@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+import speiseplan
+
+# The two saved drive folder pages stand in for google drive: the first one
+# lists KW 4-6, the second one, a week later, KW 6-8
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_page(name):
+    with open(os.path.join(here, name), encoding='utf-8') as f:
+        return speiseplan.parse_folder_page(f.read())
+
+
+@pytest.fixture
+def first_week():
+    return load_page('1WB5lNSE901jWigIAk0dgxKIG-ljaSzQO')
+
+
+@pytest.fixture
+def second_week():
+    return load_page('Speiseplanx')
+
+
+class FakeDrive:
+    """ fetch= for sync_folder(), writes the file id as the pdf and remembers what was fetched """
+
+    def __init__(self, fail_on=None):
+        self.fetched = []
+        self.fail_on = fail_on
+
+    def __call__(self, file_id, output):
+        if file_id == self.fail_on:
+            raise OSError('download failed')
+        self.fetched.append(file_id)
+        with open(output, 'wb') as f:
+            f.write(file_id.encode())
+
+
+def test_parse_folder_page(first_week):
+    assert [entry['name'] for entry in first_week] == [f'Speiseplan Würzburg KW {week}.pdf' for week in (4, 5, 6)]
+    assert first_week[0]['id'] == '1F752ODgLHINvtRGWR9pYPBwK5B4QfukJ'
+    assert all(entry['size'] > 0 and entry['modified'] > 0 for entry in first_week)
+
+
+def test_first_sync_downloads_everything(tmp_path, first_week):
+    path = str(tmp_path / 'Speiseplan')
+    drive = FakeDrive()
+    entries, added, changed, removed = speiseplan.sync_folder(first_week, path, fetch=drive)
+
+    assert added == [entry['name'] for entry in first_week]
+    assert (changed, removed) == ([], [])
+    assert drive.fetched == [entry['id'] for entry in first_week]
+    assert sorted(os.listdir(path)) == sorted(added + [speiseplan.manifest_name])
+    assert all(entry['sha256'] == speiseplan.file_hash(os.path.join(path, entry['name'])) for entry in entries)
+
+
+def test_unchanged_listing_downloads_nothing(tmp_path, first_week):
+    path = str(tmp_path / 'Speiseplan')
+    speiseplan.sync_folder(first_week, path, fetch=FakeDrive())
+    drive = FakeDrive()
+    entries, added, changed, removed = speiseplan.sync_folder(first_week, path, fetch=drive)
+
+    assert drive.fetched == []
+    assert (added, changed, removed) == ([], [], [])
+    assert [entry['name'] for entry in entries] == [entry['name'] for entry in first_week]
+
+
+def test_next_week_adds_and_removes(tmp_path, first_week, second_week):
+    path = str(tmp_path / 'Speiseplan')
+    speiseplan.sync_folder(first_week, path, fetch=FakeDrive())
+    drive = FakeDrive()
+    entries, added, changed, removed = speiseplan.sync_folder(second_week, path, fetch=drive)
+
+    assert added == ['Speiseplan Würzburg KW 7.pdf', 'Speiseplan Würzburg KW 8.pdf']
+    assert changed == []
+    assert sorted(removed) == ['Speiseplan Würzburg KW 4.pdf', 'Speiseplan Würzburg KW 5.pdf']
+    assert drive.fetched == [entry['id'] for entry in second_week[1:]] #KW 6 is kept
+    assert sorted(os.listdir(path)) == sorted([entry['name'] for entry in second_week] + [speiseplan.manifest_name])
+    assert not os.path.exists(path + '.tmp') and not os.path.exists(path + '.old')
+
+
+def test_changed_file_is_downloaded_again(tmp_path, first_week):
+    path = str(tmp_path / 'Speiseplan')
+    speiseplan.sync_folder(first_week, path, fetch=FakeDrive())
+    listing = [dict(entry) for entry in first_week]
+    listing[2]['modified'] += 1000
+    listing[2]['size'] += 1
+    drive = FakeDrive()
+    entries, added, changed, removed = speiseplan.sync_folder(listing, path, fetch=drive)
+
+    assert (added, changed, removed) == ([], ['Speiseplan Würzburg KW 6.pdf'], [])
+    assert drive.fetched == [listing[2]['id']]
+    assert speiseplan.load_manifest(path)[listing[2]['id']]['modified'] == listing[2]['modified']
+
+
+def test_failed_download_keeps_the_old_folder(tmp_path, first_week, second_week):
+    path = str(tmp_path / 'Speiseplan')
+    speiseplan.sync_folder(first_week, path, fetch=FakeDrive())
+    before = sorted(os.listdir(path))
+    manifest = speiseplan.load_manifest(path)
+
+    with pytest.raises(OSError):
+        speiseplan.sync_folder(second_week, path, fetch=FakeDrive(fail_on=second_week[2]['id']))
+
+    assert sorted(os.listdir(path)) == before
+    assert speiseplan.load_manifest(path) == manifest
+    assert not os.path.exists(path + '.tmp')
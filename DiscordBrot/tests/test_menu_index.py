@@ -0,0 +1,135 @@
+import json
+import os
+import time
+
+import speiseplan
+
+# Text like pdftotext gets out of the weekly menu pdfs: a title, day lines
+# with and without dates, dishes over several lines, prices and allergens.
+menu_text = """Speiseplan KW 7
+Mensa am Campus, 12.02. - 16.02.2024
+Alle Preise inkl. MwSt.
+
+Montag, 12.02.2024
+Spaghetti Bolognese (1,3,G) 4,50 €
+mit Parmesan
+
+Gemüsecurry mit Reis (A,F) 3,80 EUR
+
+DIENSTAG 13.02.
+Schnitzel Wiener Art
+mit Pommes frites (1, 2, A) 5,20€
+
+Mittwoch - 14.02.24: Linsensuppe (9) 2,90
+Donnerstag:
+Hähnchen Curry mit Reis (A) 4,90 €
+Freitag, 16.02.2024
+Fischstäbchen (D, G) 4,10 €
+
+""" + "Für Fragen zu Allergenen wenden Sie sich bitte an das Personal an der Ausgabe. " * 3 + """
+"""
+
+next_week_text = """Speiseplan KW 8
+Montag 19.02.
+Milchreis mit Zimt und Zucker 2,50 €
+Dienstag 20.02.
+Kürbissuppe (9) 2,90 €
+"""
+
+
+def test_parse_menu_splits_the_days():
+    days = speiseplan.parse_menu(menu_text)
+    assert list(days) == ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag']
+
+
+def test_parse_menu_leaves_out_prices_and_allergens():
+    days = speiseplan.parse_menu(menu_text)
+    assert days['Montag'][1] == 'Gemüsecurry mit Reis'
+    assert days['Mittwoch'] == ['Linsensuppe'] #dish on the day line, after the date
+    dishes = [dish for day in days.values() for dish in day]
+    assert not any('€' in dish or 'EUR' in dish or '(' in dish for dish in dishes)
+
+
+def test_parse_menu_joins_dishes_over_several_lines():
+    days = speiseplan.parse_menu(menu_text)
+    assert days['Montag'][0] == 'Spaghetti Bolognese mit Parmesan'
+    assert days['Dienstag'] == ['Schnitzel Wiener Art mit Pommes frites']
+
+
+def test_parse_menu_skips_the_title_and_long_notes():
+    days = speiseplan.parse_menu(menu_text)
+    dishes = [dish for day in days.values() for dish in day]
+    assert not any('Speiseplan' in dish or 'MwSt' in dish for dish in dishes)
+    # the note at the bottom is too long to be a dish
+    assert days['Freitag'] == ['Fischstäbchen']
+    assert speiseplan.parse_menu("no days in here\n\njust text") == {}
+
+
+def test_parse_day():
+    monday = time.strptime('2024-02-12', '%Y-%m-%d')
+    sunday = time.strptime('2024-02-18', '%Y-%m-%d')
+    assert speiseplan.parse_day('Montag') == 0
+    assert speiseplan.parse_day('  mittwoch ') == 2
+    assert speiseplan.parse_day('Fr') == 4
+    assert speiseplan.parse_day('thursday') == 3
+    assert speiseplan.parse_day('SUN') == 6
+    assert speiseplan.parse_day('heute', monday) == 0
+    assert speiseplan.parse_day('today', sunday) == 6
+    assert speiseplan.parse_day('morgen', monday) == 1
+    assert speiseplan.parse_day('tomorrow', sunday) == 0
+    assert speiseplan.parse_day('Feiertag') is None
+
+
+def make_index(tmp_path, texts):
+    """ A MenuIndex updated from texts {name: text}, and the names that were extracted """
+    index = speiseplan.MenuIndex(str(tmp_path / 'index.json'))
+    entries = [{'id': name, 'name': name, 'sha256': str(hash(text))} for name, text in texts.items()]
+    extracted = index.update(entries, str(tmp_path), extract=lambda path: texts[os.path.basename(path)])
+    return index, entries, extracted
+
+
+def test_lookup_by_day_and_search(tmp_path):
+    index, _, extracted = make_index(tmp_path, {'KW 7.pdf': menu_text, 'KW 8.pdf': next_week_text})
+    assert extracted == ['KW 7.pdf', 'KW 8.pdf']
+
+    assert index.lookup(0) == [
+        ('Montag', 'Spaghetti Bolognese mit Parmesan'),
+        ('Montag', 'Gemüsecurry mit Reis'),
+        ('Montag', 'Milchreis mit Zimt und Zucker'),
+    ]
+    assert index.lookup(None, 'REIS') == [
+        ('Montag', 'Gemüsecurry mit Reis'),
+        ('Montag', 'Milchreis mit Zimt und Zucker'),
+        ('Donnerstag', 'Hähnchen Curry mit Reis'),
+    ]
+    assert index.lookup(3, 'reis') == [('Donnerstag', 'Hähnchen Curry mit Reis')]
+    assert index.lookup(1, 'reis') == []
+    assert index.lookup(6) == []
+    assert len(index.lookup()) == 8
+
+
+def test_update_only_extracts_new_or_changed_pdfs(tmp_path):
+    index, entries, _ = make_index(tmp_path, {'KW 7.pdf': menu_text, 'KW 8.pdf': next_week_text})
+
+    def extract(path):
+        raise AssertionError(f"{path} didn't change")
+
+    assert index.update(entries, str(tmp_path), extract=extract) == []
+
+    changed = [dict(entries[1], sha256='new'), {'id': 'KW 9.pdf', 'name': 'KW 9.pdf', 'sha256': '9'}]
+    texts = {'KW 8.pdf': "Montag\nPfannkuchen\n", 'KW 9.pdf': "Freitag\nPizza Margherita\n"}
+    extracted = index.update(changed, str(tmp_path), extract=lambda path: texts[os.path.basename(path)])
+
+    assert extracted == ['KW 8.pdf', 'KW 9.pdf']
+    assert index.lookup() == [('Montag', 'Pfannkuchen'), ('Freitag', 'Pizza Margherita')] #KW 7 was dropped
+
+
+def test_index_survives_a_restart(tmp_path):
+    index, _, _ = make_index(tmp_path, {'KW 7.pdf': menu_text})
+    index.save()
+
+    loaded = speiseplan.MenuIndex(str(tmp_path / 'index.json'))
+    assert loaded.lookup() == index.lookup()
+    with open(tmp_path / 'index.json', encoding='utf-8') as f:
+        assert 'Gemüsecurry mit Reis' in f.read() #readable, not \u escaped
+    assert json.loads((tmp_path / 'index.json').read_text(encoding='utf-8'))['KW 7.pdf']['name'] == 'KW 7.pdf'
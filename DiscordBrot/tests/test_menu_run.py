@@ -0,0 +1,67 @@
+import asyncio
+
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import scheduler
+
+# The menu messages a run posted are kept in the schedule state. The next run
+# deletes them before it posts the new menu, also when the bot was restarted
+# in between and discord.py's delete_after timers were lost.
+
+
+def posted_ids(channels):
+    return [[channel.id, msg.id] for channel in channels for msg in channel.sent]
+
+
+def test_next_run_deletes_the_last_menu_after_a_restart(bot, menu_channels, monkeypatch):
+    asyncio.run(bot.run_menu("scheduled"))
+    first = [msg for channel in menu_channels for msg in channel.sent]
+    assert len(first) == 2 #the upload and the embeds in the second channel
+    assert sorted(bot.menu_schedule.posted) == sorted(posted_ids(menu_channels))
+    assert bot.menu_schedule.posted_until > datetime.now(timezone.utc) + timedelta(minutes=59)
+
+    # a restart loads the state from the file again
+    schedule = bot.menu_schedule
+    monkeypatch.setattr(bot, 'menu_schedule', scheduler.Schedule(schedule.cron, schedule.tz, schedule.path))
+    asyncio.run(bot.run_menu("scheduled"))
+
+    assert all(msg.deleted for msg in first)
+    second = [msg for channel in menu_channels for msg in channel.sent if msg not in first]
+    assert len(second) == 2 and not any(msg.deleted for msg in second)
+    assert sorted(bot.menu_schedule.posted) == sorted([msg.channel.id, msg.id] for msg in second)
+
+
+def test_startup_only_deletes_a_menu_whose_time_is_up(bot, menu_channels):
+    channel = menu_channels[0]
+
+    async def main():
+        msg = await channel.send(content='menu')
+        bot.menu_schedule.add_posted(channel.id, msg.id, datetime.now(timezone.utc) + timedelta(hours=1))
+        await bot.delete_posted_menu(expired_only=True)
+        kept = not msg.deleted
+
+        bot.menu_schedule.posted_until = datetime.now(timezone.utc) - timedelta(minutes=1)
+        bot.menu_schedule.add_posted(channel.id, 12345, bot.menu_schedule.posted_until) #deleted by hand already
+        await bot.delete_posted_menu(expired_only=True)
+        return msg, kept
+
+    msg, kept = asyncio.run(main())
+
+    assert kept
+    assert msg.deleted
+    assert bot.menu_schedule.posted == []
+    assert scheduler.Schedule(bot.menu_schedule.cron, bot.menu_schedule.tz, bot.menu_schedule.path).posted == []
+
+
+def test_other_channels_get_the_upload_forwarded(bot, menu_channels):
+    asyncio.run(bot.pdf_loop())
+
+    upload, = menu_channels[0].sent
+    forward, = menu_channels[1].sent
+    assert len(upload.files) == 2
+    assert forward.files == [] and forward.embeds == [] #nothing that points at the upload's cdn urls
+    assert (forward.reference.message_id, forward.reference.channel_id) == (upload.id, menu_channels[0].id)
+    assert forward.reference.type == discord.MessageReferenceType.forward
+    assert forward.delete_after == upload.delete_after
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import time
+
+import speiseplan
+
+from fakes import FakeMessage
+
+# pdf_loop converts the menu pdfs on a thread pool. While a large pdf is
+# converted the event loop has to keep running the games, so a game started
+# with ▶ keeps getting its frames from run_game the whole time.
+
+conversion_seconds = 0.3
+tick_interval = 0.01
+
+
+def slow_render(pdf_path, profile=speiseplan.default_profile):
+    time.sleep(conversion_seconds) #pdftoppm on a large pdf, blocking like the real one
+    return b'image of ' + os.path.basename(pdf_path).encode()
+
+
+def test_games_keep_ticking_while_pdf_loop_converts(bot, menu_channels, monkeypatch):
+    channel = menu_channels[0]
+    monkeypatch.setattr(speiseplan, 'render_pdf', slow_render)
+    monkeypatch.setattr(bot, 'tick_interval', tick_interval)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', '')
+
+    async def main():
+        session = bot.TetrisSession(FakeMessage(), 1)
+        bot.sessions[session.msg.id] = session
+        bot.start_game(session)
+        start = time.perf_counter()
+        await bot.pdf_loop()
+        end = time.perf_counter()
+        still_running = not session.task.done()
+        session.task.cancel()
+        return session, start, end, still_running
+
+    session, start, end, still_running = asyncio.run(main())
+
+    # both pdfs were converted one after the other and posted in one message
+    assert end - start >= conversion_seconds * 2
+    assert len(channel.sent) == 1
+    assert [file.filename for file in channel.sent[0].files] == ['2.jpg', '3.jpg']
+    assert still_running
+
+    frames = [when for when, _ in session.msg.edits if start <= when <= end]
+    # a frame about every tick_interval, at least a third of them even on a slow machine
+    assert len(frames) >= (end - start) / tick_interval / 3
+    # and no frame was held back for anything close to a conversion
+    gaps = [later - earlier for earlier, later in zip(frames, frames[1:])]
+    assert max(gaps) < conversion_seconds / 2
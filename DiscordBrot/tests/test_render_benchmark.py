@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import speiseplan
+
+# `python speiseplan.py <pdf>` times render_all(), which runs load_or_render()
+# on a render_pool(). pdf_loop has to render through the same two, or the
+# benchmark doesn't measure what the bot does.
+
+
+def counting_render(renders):
+    lock = threading.Lock()
+
+    def render(pdf_path, profile=speiseplan.default_profile):
+        with lock:
+            renders.append(pdf_path)
+        return b'image'
+    return render
+
+
+def test_benchmark_renders_through_the_cache(tmp_path, monkeypatch):
+    renders = []
+    monkeypatch.setattr(speiseplan, 'render_pdf', counting_render(renders))
+    pdf_path = tmp_path / 'menu.pdf'
+    pdf_path.write_bytes(b'%PDF-1.4 menu')
+
+    serial, parallel, cached = speiseplan.benchmark(str(pdf_path), count=4, workers=2)
+
+    # serial and parallel both render every copy, the third run only reads the cache
+    assert len(renders) == 8
+    assert min(serial, parallel, cached) > 0
+
+
+def test_pdf_loop_renders_on_the_benchmarked_pool(bot, menu_channels, monkeypatch):
+    pools = []
+    render_pool = speiseplan.render_pool
+
+    def recording_pool(workers=None):
+        pools.append(workers)
+        return render_pool(workers)
+
+    renders = []
+    monkeypatch.setattr(speiseplan, 'render_pool', recording_pool)
+    monkeypatch.setattr(speiseplan, 'render_pdf', counting_render(renders))
+    monkeypatch.setattr(bot, 'render_workers', 3)
+
+    asyncio.run(bot.pdf_loop())
+
+    assert pools == [3]
+    assert len(renders) == 2
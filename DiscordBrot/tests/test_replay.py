@@ -0,0 +1,120 @@
+import asyncio
+import os
+import random
+
+import tetris
+
+from fakes import FakeMessage
+
+# A game written to a replay file the way the bot does it (appended every few
+# ticks) has to play out the same when it is read back and replayed.
+
+
+def play_logged(path, seed, max_ticks, flush_every=7, greedy_ticks=400):
+    """ Plays a game, places pieces to clear lines for greedy_ticks and then moves at random
+        Returns the finished TetrisGame and the inputs of every tick
+    """
+    rng = random.Random(seed)
+    game = tetris.TetrisGame(seed)
+    game.get_random_shape()
+    log = tetris.ReplayLog()
+    log.start(game.seed, 0.0)
+    placed = None
+    ticks = []
+    for i in range(max_ticks):
+        if i < greedy_ticks:
+            inputs = () if placed == game.index else tetris.greedy_inputs(game)
+            placed = game.index
+        else:
+            inputs = rng.choice(((), ('left',), ('right',), ('rotate',), ('down',), ('left', 'rotate', 'right', 'down', 'down')))
+        game.tick(inputs)
+        log.tick(inputs, (i + 1) * 0.75)
+        ticks.append(inputs)
+        if log.ticks >= flush_every:
+            tetris.append_replay(path, log.take())
+        if game.game_over:
+            log.end(game.points, game.lines)
+            break
+    tetris.append_replay(path, log.take())
+    return game, ticks
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / f"1{tetris.replay_extension}")
+    finished, finished_ticks = play_logged(path, 11, 20000)
+    stopped, stopped_ticks = play_logged(path, 12, 150) #stopped with ❌ before game over
+    assert finished.game_over and finished.lines > 0
+    assert not stopped.game_over
+
+    first, second = tetris.read_replay(path)
+
+    assert first['seed'] == 11
+    assert [inputs for inputs, _ in first['ticks']] == finished_ticks
+    assert {delay for _, delay in first['ticks']} == {750}
+    assert (first['points'], first['lines']) == (finished.points, finished.lines)
+    game, _ = tetris.replay(first)
+    assert (game.points, game.lines, game.rows, game.colours) == (finished.points, finished.lines, finished.rows, finished.colours)
+    assert game.game_over
+
+    assert (second['seed'], second['points'], second['lines']) == (12, None, None)
+    game, _ = tetris.replay(second)
+    assert (game.rows, game.colours, game.shape_row, game.shape_col) == (stopped.rows, stopped.colours, stopped.shape_row, stopped.shape_col)
+
+
+def test_a_cut_off_file_keeps_the_whole_records(tmp_path):
+    path = tmp_path / f"1{tetris.replay_extension}"
+    play_logged(str(path), 11, 100)
+    data = path.read_bytes()
+    path.write_bytes(data[:-2]) #the bot died while writing the last tick
+
+    game_log, = tetris.read_replay(str(path))
+    assert len(game_log['ticks']) == 99
+    assert game_log['points'] is None
+
+
+def test_running_games_are_written_every_few_ticks(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', 0.001)
+    monkeypatch.setattr(bot, 'replay_flush_ticks', 5)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', str(tmp_path / 'replays'))
+
+    async def main():
+        session = bot.TetrisSession(FakeMessage(), 1)
+        bot.sessions[session.msg.id] = session
+        bot.start_game(session)
+        while len(session.msg.edits) < 12:
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*bot.background_tasks)
+        game_log, = tetris.read_replay(os.path.join(bot.tetris_replay_folder, f"{session.msg.id}{tetris.replay_extension}"))
+        session.task.cancel()
+        return game_log
+
+    game_log = asyncio.run(main())
+    # written while the game was still running
+    assert len(game_log['ticks']) >= 10
+    assert game_log['points'] is None
+
+
+def test_a_game_that_fails_is_saved(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', 0.001)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', str(tmp_path / 'replays'))
+
+    class BrokenMessage(FakeMessage):
+        async def edit(self, **kwargs):
+            await super().edit(**kwargs)
+            if len(self.edits) == 3:
+                raise RuntimeError("bug in the game loop")
+
+    async def main():
+        session = bot.TetrisSession(BrokenMessage(), 1)
+        bot.sessions[session.msg.id] = session
+        bot.start_game(session)
+        await asyncio.gather(session.task, return_exceptions=True)
+        await asyncio.sleep(0) #the done callback
+        await asyncio.gather(*bot.background_tasks)
+        return session
+
+    session = asyncio.run(main())
+
+    game_log, = tetris.read_replay(str(tmp_path / 'replays' / f"{session.msg.id}{tetris.replay_extension}"))
+    assert len(game_log['ticks']) == 3
+    assert session.msg.id in bot.sessions #the message is still there, ▶ starts the next game
@@ -0,0 +1,119 @@
+import asyncio
+import statistics
+import time
+
+from types import SimpleNamespace
+
+import tetris
+
+from fakes import FakeMessage
+
+# run_game against a fake game message: ticks are paced from the start of
+# each tick, a slow edit doesn't slow the game down, a long stall isn't made
+# up with a burst of ticks, and ❌ stops the loop.
+
+tick_interval = 0.05
+
+
+class SlowMessage(FakeMessage):
+    """ A game message whose edits take edit_seconds, one of them stall_seconds """
+
+    def __init__(self, edit_seconds, stall_at=None, stall_seconds=0):
+        super().__init__()
+        self.edit_seconds = edit_seconds
+        self.stall_at = stall_at
+        self.stall_seconds = stall_seconds
+
+    async def edit(self, **kwargs):
+        stall = len(self.edits) == self.stall_at
+        await asyncio.sleep(self.stall_seconds if stall else self.edit_seconds)
+        self.edits.append((time.perf_counter(), kwargs.get('embed')))
+
+
+def record_ticks(bot, monkeypatch):
+    ticks = []
+    tick = tetris.TetrisGame.tick
+
+    def timed_tick(self, events=()):
+        ticks.append((time.perf_counter(), self.is_new_shape))
+        return tick(self, events)
+
+    monkeypatch.setattr(bot.TetrisSession, 'tick', timed_tick)
+    return ticks
+
+
+def run_for(bot, msg, seconds):
+    """ Starts a game on msg, lets it run for seconds and cancels it """
+    async def main():
+        session = bot.TetrisSession(msg, 1)
+        bot.sessions[msg.id] = session
+        bot.start_game(session)
+        await asyncio.sleep(seconds)
+        session.task.cancel()
+        await asyncio.gather(session.task, return_exceptions=True)
+        return session
+    return asyncio.run(main())
+
+
+def steady_gaps(ticks):
+    # a new shape is shown right away, without waiting for the next tick
+    return [later - earlier for (earlier, _), (later, new_shape) in zip(ticks, ticks[1:]) if not new_shape]
+
+
+def test_ticks_are_paced_from_their_start(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', tick_interval)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', '')
+    ticks = record_ticks(bot, monkeypatch)
+
+    # every edit takes 60% of a tick, sleeping a full tick after it would make a tick 1.6 long
+    run_for(bot, SlowMessage(tick_interval * 0.6), tick_interval * 12)
+
+    assert len(ticks) >= 8
+    assert statistics.median(steady_gaps(ticks)) < tick_interval * 1.3
+
+
+def test_a_stalled_edit_isnt_made_up_with_a_burst(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', tick_interval)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', '')
+    ticks = record_ticks(bot, monkeypatch)
+
+    # the third edit waits 5 ticks, like an edit held back by the rate limit
+    msg = SlowMessage(0, stall_at=2, stall_seconds=tick_interval * 5)
+    run_for(bot, msg, tick_interval * 12)
+
+    stalled = msg.edits[2][0]
+    after = steady_gaps([tick for tick in ticks if tick[0] >= stalled])
+    assert after, "the game stopped ticking after the stall"
+    # the ticks after it keep their pace instead of running the 4 missed ones back to back
+    assert min(after) > tick_interval * 0.5
+
+
+def test_stop_reaction_cancels_the_game(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', tick_interval)
+    monkeypatch.setattr(bot, 'tetris_controls', 'reactions')
+    monkeypatch.setattr(bot, 'tetris_replay_folder', str(tmp_path / 'replays'))
+    player = SimpleNamespace(id=1)
+
+    async def main():
+        msg = FakeMessage()
+        session = bot.TetrisSession(msg, player.id)
+        bot.sessions[msg.id] = session
+        await bot.on_reaction_add(SimpleNamespace(message=msg, emoji="▶"), player)
+        await asyncio.sleep(tick_interval * 3)
+        await bot.on_reaction_add(SimpleNamespace(message=msg, emoji="⬅"), player)
+        await asyncio.sleep(tick_interval * 2)
+        await bot.on_reaction_add(SimpleNamespace(message=msg, emoji="❌"), player)
+        edits = len(msg.edits)
+        await asyncio.sleep(tick_interval * 3)
+        await asyncio.gather(*bot.background_tasks) #the replay is written in the background
+        return session, edits
+
+    session, edits = asyncio.run(main())
+
+    assert session.task.cancelled()
+    assert session.msg.deleted
+    assert session.msg.id not in bot.sessions
+    assert len(session.msg.edits) == edits #no frames after ❌
+    assert session.inputs.empty() #⬅ was applied on the next tick
+    path = tmp_path / 'replays' / f"{session.msg.id}{tetris.replay_extension}"
+    assert path.stat().st_size > 0
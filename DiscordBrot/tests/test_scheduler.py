@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import scheduler
+
+berlin = scheduler.load_timezone('Europe/Berlin')
+sunday_noon = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+
+def test_next_monday_morning():
+    cron = scheduler.Cron('0 6 * * mon')
+    assert cron.next(sunday_noon, berlin) == datetime(2026, 10, 19, 6, 0, tzinfo=berlin)
+    # exactly at the due time the next one is a week later, across the change to winter time
+    due = cron.next(sunday_noon, berlin)
+    assert cron.next(due, berlin).isoformat() == '2026-10-26T06:00:00+01:00'
+
+
+def test_day_of_month_or_day_of_week():
+    # like cron, the 13th or any friday
+    assert scheduler.Cron('0 0 13 * fri').next(sunday_noon, berlin).date().isoformat() == '2026-10-23'
+
+
+@pytest.mark.parametrize('line', ['0 6 * *', '61 * * * *', '0 6 * * foo', '0 25 * * *'])
+def test_bad_cron_lines(line):
+    with pytest.raises(ValueError):
+        scheduler.Cron(line)
+
+
+def test_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'schedule.json')
+    schedule = scheduler.Schedule('0 6 * * 1', berlin, path)
+    first = schedule.due(sunday_noon)
+    assert first == datetime(2026, 10, 19, 6, 0, tzinfo=berlin) #not right away
+
+    restarted = scheduler.Schedule('0 6 * * 1', berlin, path)
+    assert restarted.due() == first
+
+    after_run = restarted.done(first + timedelta(minutes=5))
+    assert scheduler.Schedule('0 6 * * 1', berlin, path).due() == after_run
+    # a new cron line doesn't reuse the old due time
+    assert scheduler.Schedule('0 7 * * 1', berlin, path).next_due is None
+
+
+def test_upcoming_is_when_the_menu_gets_replaced(tmp_path):
+    schedule = scheduler.Schedule('0 6 * * 1', berlin, str(tmp_path / 'schedule.json'))
+    posted = datetime(2026, 10, 19, 4, 1, tzinfo=timezone.utc) #monday 06:01 in Berlin
+    assert schedule.upcoming(posted) - posted == timedelta(days=7, hours=1, minutes=-1) #the clocks go back on the 25th
+
+
+def test_posted_messages_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'schedule.json')
+    schedule = scheduler.Schedule('0 6 * * 1', berlin, path)
+    until = datetime(2026, 10, 26, 6, 0, tzinfo=berlin)
+    schedule.add_posted(1, 100, until)
+    schedule.add_posted(2, 200, until)
+
+    restarted = scheduler.Schedule('0 6 * * 1', berlin, path)
+    assert restarted.posted == [[1, 100], [2, 200]]
+    assert restarted.posted_until == until
+    # they were posted by the old schedule, but still have to be deleted
+    assert scheduler.Schedule('0 7 * * 1', berlin, path).posted == [[1, 100], [2, 200]]
+
+    restarted.clear_posted()
+    assert scheduler.Schedule('0 6 * * 1', berlin, path).posted == []
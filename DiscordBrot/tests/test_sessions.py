@@ -0,0 +1,42 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import tetris
+
+from fakes import FakeMessage
+
+# A game message that is deleted takes its session with it, whether the game
+# is running, over or was never started. Otherwise its player would get
+# "You are already playing a game" until the bot restarts.
+
+
+def test_deleted_game_messages_drop_their_session(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'tick_interval', 0.001)
+    monkeypatch.setattr(bot, 'tetris_replay_folder', str(tmp_path / 'replays'))
+
+    async def main():
+        waiting = bot.TetrisSession(FakeMessage(), 1) #▶ never pressed
+        running = bot.TetrisSession(FakeMessage(), 2)
+        finished = bot.TetrisSession(FakeMessage(), 3)
+        other = bot.TetrisSession(FakeMessage(), 4)
+        for session in (waiting, running, finished, other):
+            bot.sessions[session.msg.id] = session
+        bot.start_game(running)
+        bot.start_game(finished)
+        await asyncio.sleep(0.01)
+        finished.task.cancel()
+        await asyncio.gather(finished.task, return_exceptions=True)
+
+        await bot.on_raw_message_delete(SimpleNamespace(message_id=waiting.msg.id))
+        await bot.on_raw_bulk_message_delete(SimpleNamespace(message_ids={running.msg.id, finished.msg.id, 1}))
+        await asyncio.sleep(0)
+        await asyncio.gather(*bot.background_tasks)
+        return running, other
+
+    running, other = asyncio.run(main())
+
+    assert list(bot.sessions) == [other.msg.id]
+    assert running.task.cancelled()
+    game_log, = tetris.read_replay(str(tmp_path / 'replays' / f"{running.msg.id}{tetris.replay_extension}"))
+    assert game_log['ticks']
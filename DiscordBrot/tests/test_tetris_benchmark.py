@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# The tick benchmarks of tetris.benchmark() against the numbers in
+# tetris_benchmark.json, so a change that makes the game loop a lot slower
+# fails before it is deployed.
+# Ticks per second depend on the machine, so they are stored relative to a
+# plain python loop timed on the same machine. Only a drop below
+# min_ratio of the baseline fails, the numbers move by a third between runs.
+# After a change that is meant to be slower (or faster), write a new baseline:
+#   python tests/test_tetris_benchmark.py
+
+#conftest.py does this under pytest, not when the baseline is written
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tetris
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tetris_benchmark.json')
+scenarios = ('idle', 'hard drops', 'rotations', 'line clears')
+ticks = 5000
+runs = 3 #the fastest run counts, the others were slowed down by something else
+min_ratio = 0.5
+
+
+def reference_speed(loops=200000):
+    """ Loops per second of bit operations on a list, like a tick does them """
+    best = 0
+    for _ in range(runs):
+        rows = [0] * tetris.num_of_rows
+        start = time.perf_counter()
+        for i in range(loops):
+            row = i % tetris.num_of_rows
+            rows[row] = (rows[row] | 1 << i % tetris.num_of_cols) & 0x3FF
+        best = max(best, loops / (time.perf_counter() - start))
+    return best
+
+
+def relative_speed(name):
+    best = max(tetris.benchmark(ticks, 0, (name,))[name][0] for _ in range(runs))
+    return best / reference_speed()
+
+
+def load_baseline():
+    with open(baseline_path) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('name', scenarios)
+def test_ticks_per_second(name):
+    expected = load_baseline()[name]
+    speed = relative_speed(name)
+    assert speed >= expected * min_ratio, f"{name}: {speed / expected:.0%} of the baseline speed"
+
+
+if __name__ == '__main__':
+    baseline = {name: round(relative_speed(name), 5) for name in scenarios}
+    with open(baseline_path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+    print(json.dumps(baseline, indent=2))
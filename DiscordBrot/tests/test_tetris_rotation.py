@@ -0,0 +1,57 @@
+import tetris
+
+
+def test_pieces_use_their_kick_sets():
+    assert tetris.shape_I.wall_kicks is tetris.i_wall_kicks
+    assert tetris.shape_O.wall_kicks is tetris.no_wall_kicks
+    for shape in (tetris.shape_J, tetris.shape_L, tetris.shape_S, tetris.shape_T, tetris.shape_Z):
+        assert shape.wall_kicks is tetris.main_wall_kicks
+
+
+def place(game, shape, rotation, row, col):
+    game.shape = shape
+    game.rotation_pos = rotation
+    game.shape_row = row
+    game.shape_col = col
+    assert game.fits(rotation, row, col)
+
+
+def test_i_piece_kicks_off_the_left_wall():
+    game = tetris.TetrisGame(0)
+    # standing I in the left most column, lying down in place would stick out of the board
+    place(game, tetris.shape_I, 1, 5, -2)
+    assert not game.fits(2, 5, -2)
+
+    assert game.rotate_shape()
+    assert game.rotation_pos == 2
+    assert game.shape_col > -2 #kicked to the right
+    assert min(col for _, col in game.shape_pos()) == 0
+
+
+def test_i_piece_kicks_off_the_right_wall():
+    game = tetris.TetrisGame(0)
+    place(game, tetris.shape_I, 3, 5, tetris.num_of_cols - 2)
+    assert not game.fits(0, 5, tetris.num_of_cols - 2)
+
+    assert game.rotate_shape()
+    assert game.rotation_pos == 0
+    assert max(col for _, col in game.shape_pos()) == tetris.num_of_cols - 1
+
+
+def test_rotation_without_room_keeps_the_shape():
+    game = tetris.TetrisGame(0)
+    # fill everything but a one wide shaft in col 0, a standing I can't lie down anywhere
+    for row in range(tetris.num_of_rows):
+        game.rows[row] = tetris.full_row & ~1
+    place(game, tetris.shape_I, 1, 10, -2)
+
+    assert not game.rotate_shape()
+    assert (game.rotation_pos, game.shape_row, game.shape_col) == (1, 10, -2)
+
+
+def test_o_piece_doesnt_rotate():
+    game = tetris.TetrisGame(0)
+    place(game, tetris.shape_O, 0, 5, 3)
+    before = game.shape_pos()
+    game.rotate_shape()
+    assert sorted(game.shape_pos()) == sorted(before)
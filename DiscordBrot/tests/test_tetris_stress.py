@@ -0,0 +1,51 @@
+import random
+import tracemalloc
+
+import tetris
+
+
+def play(game, rng, ticks):
+    games = 0
+    for _ in range(ticks):
+        game.tick(rng.choice(((), (), ('left',), ('right',), ('rotate',), ('down',))))
+        if game.game_over:
+            games += 1
+            game.reset(game.seed + 1)
+            game.get_random_shape()
+    return games
+
+
+def test_thousands_of_ticks_keep_memory_flat():
+    rng = random.Random(1)
+    game = tetris.TetrisGame(1)
+    game.get_random_shape()
+    play(game, rng, 2000) #warm up the row cache of format_row and the bags
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        games = play(game, rng, 20000)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    assert games > 10 #games end and start again, so reset() is covered too
+    assert after - before < 64 * 1024
+
+
+def test_board_stays_consistent():
+    rng = random.Random(2)
+    game = tetris.TetrisGame(2)
+    game.get_random_shape()
+    for _ in range(5000):
+        game.tick(rng.choice(((), ('left',), ('right',), ('rotate',), ('down',))))
+        if game.game_over:
+            game.reset(game.seed + 1)
+            game.get_random_shape()
+        for row, mask in enumerate(game.rows):
+            assert mask != tetris.full_row #full rows are cleared in the same tick
+            for col in range(tetris.num_of_cols):
+                assert bool(mask >> col & 1) == bool(game.colours[row * tetris.num_of_cols + col])
+        for col in range(tetris.num_of_cols):
+            top = next((row for row in range(tetris.num_of_rows) if game.rows[row] >> col & 1), tetris.num_of_rows)
+            assert game.heights[col] == top
@@ -0,0 +1,644 @@
+import functools
+import os
+import random
+import struct
+import time
+
+from collections import deque, namedtuple
+
+# The Tetris engine, the board, pieces and rules, without anything Discord.
+# DiscordBrot.py wraps a TetrisGame in a session with the game message and
+# its input queue. Everything in here is plain python, so it can be run
+# headless for benchmarks with `python tetris.py`.
+
+num_of_rows = 18
+num_of_cols = 10
+empty_square = ':black_large_square:'
+blue_square = ':blue_square:'
+brown_square = ':brown_square:'
+orange_square = ':orange_square:'
+yellow_square = ':yellow_square:'
+green_square = ':green_square:'
+purple_square = ':purple_square:'
+red_square = ':red_square:'
+
+
+main_wall_kicks = ( #for J, L, T, S, Z tetronimos, [row, col] offsets to try when rotating clockwise out of each rotation
+                    ((0, 0), (0, -1), (-1, -1), (2, 0), (2, -1)),
+                    ((0, 0), (0, 1), (1, 1), (-2, 0), (-2, 1)),
+                    ((0, 0), (0, 1), (-1, 1), (2, 0), (2, 1)),
+                    ((0, 0), (0, -1), (1, -1), (-2, 0), (-2, -1))
+                    )
+
+i_wall_kicks = ( #for I tetronimo
+                ((0, 0), (0, -2), (0, 1), (1, -2), (-2, 1)),
+                ((0, 0), (0, -1), (0, 2), (-2, -1), (1, 2)),
+                ((0, 0), (0, 2), (0, -1), (-1, 2), (2, -1)),
+                ((0, 0), (0, 1), (0, -2), (2, 1), (-1, -2))
+                )
+
+no_wall_kicks = (((0, 0),),) * 4 #for O tetronimo, it doesn't rotate
+
+
+# The board is stored as one integer per row, bit c is set when column c is
+# taken, plus a bytearray with the colour code of every square. Collisions
+# and full rows are plain bit tests, emojis are only looked up when a frame
+# is rendered. The falling shape isn't part of the board until it is placed.
+square_emojis = [empty_square, blue_square, brown_square, orange_square, yellow_square, green_square, purple_square, red_square]
+colour_codes = {emoji: code for code, emoji in enumerate(square_emojis)}
+full_row = (1 << num_of_cols) - 1
+line_points = (0, 100, 300, 500, 800) #points for clearing 0, 1, 2, 3 or 4 lines at once
+
+
+class Tetronimo: #Tetris pieces
+    """ A piece with all four rotations worked out once at import time
+
+        squares are the [row, col] squares of the spawn rotation inside a
+        box_size x box_size box. Rotating clockwise turns the box, so a
+        rotation is just a look up in rotations (square offsets) and masks
+        (one bitmask per row, used for collisions with the board).
+    """
+
+    def __init__(self, squares, colour, box_size, wall_kicks):
+        self.colour = colour
+        self.code = colour_codes[colour]
+        self.wall_kicks = wall_kicks #kick set to try when rotating out of rotation n
+        rotations = []
+        cur = [tuple(square) for square in squares]
+        for rotation in range(4):
+            rotations.append(tuple(sorted(cur)))
+            if wall_kicks is not no_wall_kicks:
+                cur = [(col, box_size - 1 - row) for row, col in cur] #turn the box clockwise
+        self.rotations = tuple(rotations)
+        self.masks = tuple(self.make_masks(offsets) for offsets in self.rotations)
+        self.bottoms = tuple(self.make_bottoms(offsets) for offsets in self.rotations)
+
+    @staticmethod
+    def make_masks(offsets):
+        """ Returns (left most col, width, ((row, bitmask of the row), ...)) for one rotation """
+        left = min(col for row, col in offsets)
+        width = max(col for row, col in offsets) - left + 1
+        rows = {}
+        for row, col in offsets:
+            rows[row] = rows.get(row, 0) | 1 << (col - left)
+        return left, width, tuple(sorted(rows.items()))
+
+    @staticmethod
+    def make_bottoms(offsets):
+        """ Returns ((col, lowest row in that col), ...) for one rotation, used for hard drops """
+        bottoms = {}
+        for row, col in offsets:
+            bottoms[col] = max(row, bottoms.get(col, row))
+        return tuple(sorted(bottoms.items()))
+
+
+#starting spots, the box is placed at spawn_row, spawn_col so the shapes start right above the board. Col is 3/4 to start in middle
+spawn_row = -1
+spawn_col = 3
+shape_I = Tetronimo([[1, 0], [1, 1], [1, 2], [1, 3]], blue_square, 4, i_wall_kicks)
+shape_J = Tetronimo([[0, 0], [1, 0], [1, 1], [1, 2]], brown_square, 3, main_wall_kicks)
+shape_L = Tetronimo([[0, 2], [1, 0], [1, 1], [1, 2]], orange_square, 3, main_wall_kicks)
+shape_O = Tetronimo([[0, 1], [0, 2], [1, 1], [1, 2]], yellow_square, 4, no_wall_kicks)
+shape_S = Tetronimo([[0, 1], [0, 2], [1, 0], [1, 1]], green_square, 3, main_wall_kicks)
+shape_T = Tetronimo([[0, 1], [1, 0], [1, 1], [1, 2]], purple_square, 3, main_wall_kicks)
+shape_Z = Tetronimo([[0, 0], [0, 1], [1, 1], [1, 2]], red_square, 3, main_wall_kicks)
+shapes = (shape_I, shape_J, shape_L, shape_O, shape_S, shape_T, shape_Z)
+
+
+class PieceBag:
+    """ Hands out the shapes in bags of all seven in a shuffled order (7-bag)
+        so there are never more than 12 shapes between two of the same kind.
+        The order only depends on the seed, and the next preview shapes are
+        always known. Shapes are the shared Tetronimo objects, which are
+        never changed, so nothing is copied per spawn.
+    """
+    __slots__ = ('rng', 'queue', 'preview')
+
+    def __init__(self, seed, preview=3):
+        self.rng = random.Random(seed)
+        self.queue = deque()
+        self.preview = preview #how many shapes peek() can look ahead
+        self.fill()
+
+    def fill(self):
+        while len(self.queue) <= self.preview:
+            bag = list(shapes)
+            self.rng.shuffle(bag)
+            self.queue.extend(bag)
+
+    def next(self):
+        shape = self.queue.popleft()
+        if len(self.queue) < self.preview:
+            self.fill()
+        return shape
+
+    def peek(self, count=1):
+        """ The next count shapes, count can be at most preview """
+        return tuple(self.queue[i] for i in range(count))
+
+
+#board filled with empty squares
+def make_empty_board():
+    return [0] * num_of_rows, bytearray(num_of_rows * num_of_cols)
+
+
+def format_board_as_str(colours, shape_pos=None, shape_code=0):
+    """ Renders the colour codes (and the falling shape on top) as emojis """
+    codes = bytearray(colours)
+    if shape_pos is not None:
+        for square_row, square_col in shape_pos:
+            if 0 <= square_row < num_of_rows:
+                codes[square_row * num_of_cols + square_col] = shape_code
+    return ''.join([format_row(bytes(codes[row * num_of_cols:(row + 1) * num_of_cols])) for row in range(num_of_rows)])
+
+
+@functools.lru_cache(maxsize=None)
+def format_preview(shape):
+    """ Emojis of a shape on its own, for showing the next shape """
+    box = [[empty_square] * 4 for _ in range(2)]
+    for square_row, square_col in shape.rotations[0]:
+        box[square_row][square_col] = shape.colour
+    return ''.join([''.join(row) + "\n " for row in box])
+
+
+@functools.lru_cache(maxsize=4096)
+def format_row(codes):
+    """ Emojis of one row of colour codes, most rows look the same so they are cached """
+    return ''.join([square_emojis[code] for code in codes]) + "\n " # + " " possibly
+
+# What step() returns: the board rows as bitmasks, the falling piece and the score
+GameState = namedtuple('GameState', ['rows', 'shape', 'rotation', 'row', 'col', 'next_shape', 'points', 'lines', 'game_over'])
+
+
+class TetrisGame:
+    """ State and rules of one game of Tetris, without anything Discord
+        Pieces come from a PieceBag of the game's own, so two games with the
+        same seed and the same inputs play out exactly the same.
+    """
+    __slots__ = ('seed', 'bag', 'rows', 'colours', 'heights', 'shape', 'shape_row', 'shape_col', 'points', 'lines',
+                 'down_pressed', 'rotation_pos', 'is_new_shape', 'start_higher', 'game_over', 'index')
+
+    moves = ('left', 'right', 'down', 'rotate') #inputs tick() and step() understand
+
+    def __init__(self, seed=None):
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """ Starts a new game, a new random seed is picked if seed is None """
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.bag = PieceBag(seed)
+        self.rows, self.colours = make_empty_board()
+        self.heights = [num_of_rows] * num_of_cols #row of the top most square in each col
+        self.points = 0
+        self.lines = 0 #how many lines cleared
+        self.down_pressed = False #if down button has been pressed
+        self.is_new_shape = False
+        self.start_higher = False #for when near top of board
+        self.game_over = False
+        self.index = 0
+        self.shape = None #current Tetronimo, its box is at shape_row, shape_col
+        self.shape_row = 0
+        self.shape_col = 0
+        self.rotation_pos = 0
+
+    def shape_pos(self):
+        """ Board squares of the current shape """
+        row = self.shape_row
+        col = self.shape_col
+        return [(row + square_row, col + square_col) for square_row, square_col in self.shape.rotations[self.rotation_pos]]
+
+    def format_board_as_str(self):
+        if self.shape is None:
+            return format_board_as_str(self.colours)
+        return format_board_as_str(self.colours, self.shape_pos(), self.shape.code)
+
+    def fits(self, rotation, row, col):
+        """ True if the current shape in that rotation fits with its box at row, col
+            Squares above the board are always free
+        """
+        left, width, masks = self.shape.masks[rotation]
+        col += left
+        if col < 0 or col + width > num_of_cols:
+            return False
+        rows = self.rows
+        for square_row, mask in masks:
+            square_row += row
+            if square_row >= num_of_rows:
+                return False
+            if square_row >= 0 and rows[square_row] & mask << col:
+                return False
+        return True
+
+    def place_shape(self):
+        """ Writes the current shape into the board once it can't move anymore """
+        code = self.shape.code
+        heights = self.heights
+        for square_row, square_col in self.shape_pos():
+            if 0 <= square_row < num_of_rows: #squares above the board are lost
+                self.rows[square_row] |= 1 << square_col
+                self.colours[square_row * num_of_cols + square_col] = code
+                if square_row < heights[square_col]:
+                    heights[square_col] = square_row
+
+    def get_random_shape(self):
+        # ordered_shapes = [shape_J, shape_T, shape_L, shape_O, shape_S, shape_Z, shape_S, shape_T, shape_J, shape_Z, shape_S, shape_I, shape_Z, shape_O, shape_T, shape_J, shape_L, shape_Z, shape_I]
+        # random_shape = ordered_shapes[self.index]
+        self.shape = self.bag.next()
+        self.index += 1
+        self.shape_row = spawn_row - 1 if self.start_higher else spawn_row #make row 1 above
+        self.shape_col = spawn_col
+        self.rotation_pos = 0
+        self.is_new_shape = True
+        return self.shape
+
+    def next_shape(self):
+        """ The shape that comes after the current one """
+        return self.bag.queue[0]
+
+    def rotate_shape(self):
+        """ Rotates the current shape clockwise, trying the kicks of its kick set in order
+            The shape stays as it is if none of them fit
+        """
+        new_rotation = (self.rotation_pos + 1) % 4
+        for kick_row, kick_col in self.shape.wall_kicks[self.rotation_pos]:
+            if self.fits(new_rotation, self.shape_row + kick_row, self.shape_col + kick_col):
+                self.shape_row += kick_row
+                self.shape_col += kick_col
+                self.rotation_pos = new_rotation
+                return True
+        return False
+
+    def clear_lines(self):
+        """ Removes full rows and moves the rows above down, in a single pass from the bottom up """
+        rows = self.rows
+        if full_row not in rows:
+            return
+        colours = self.colours
+        lines_to_clear = 0
+        write = num_of_rows - 1 #row the next kept row ends up in
+        for row in range(num_of_rows - 1, -1, -1):
+            if rows[row] == full_row: #if line to clear
+                lines_to_clear += 1
+                continue
+            if write != row:
+                rows[write] = rows[row]
+                colours[write * num_of_cols:(write + 1) * num_of_cols] = colours[row * num_of_cols:(row + 1) * num_of_cols]
+            write -= 1
+        #the top rows are empty now
+        for row in range(write + 1):
+            rows[row] = 0
+        colours[:(write + 1) * num_of_cols] = bytes((write + 1) * num_of_cols)
+        self.update_heights()
+
+        self.points += line_points[lines_to_clear]
+        self.lines += lines_to_clear
+
+    def update_heights(self):
+        """ Works out the top most square of every col again after lines were cleared """
+        heights = self.heights
+        seen = 0
+        for col in range(num_of_cols):
+            heights[col] = num_of_rows
+        for row, mask in enumerate(self.rows):
+            new = mask & ~seen
+            if new:
+                seen |= new
+                for col in range(num_of_cols):
+                    if new >> col & 1:
+                        heights[col] = row
+                if seen == full_row:
+                    break
+
+    def drop_distance(self, col):
+        """ How far the current shape can fall with its box at col
+            Worked out from the height of each col under the shape, unless a
+            square of the shape is already below the top of its col (slid
+            under an overhang), then the shape is moved down row by row
+        """
+        row = self.shape_row
+        heights = self.heights
+        distance = num_of_rows
+        for square_col, square_row in self.shape.bottoms[self.rotation_pos]:
+            gap = heights[col + square_col] - 1 - (row + square_row)
+            if gap < 0:
+                distance = 0
+                while self.fits(self.rotation_pos, row + distance + 1, col):
+                    distance += 1
+                return distance
+            if gap < distance:
+                distance = gap
+        return distance
+
+    def get_next_pos(self):
+        """ Returns [rows to move the shape down, False if it can't move and has to be placed]
+            Drops the shape as far as it goes when down was pressed
+        """
+        if not self.fits(self.rotation_pos, self.shape_row + 1, self.shape_col):
+            if self.is_new_shape: #if can't place new shape
+                if self.start_higher == True:
+                    self.game_over = True
+                else:
+                    self.start_higher = True
+            return [1, False]
+
+        movement_amnt = 1
+        if self.down_pressed == True: #furthest available space
+            movement_amnt = self.drop_distance(self.shape_col)
+        return [movement_amnt, True]
+
+    def apply_input(self, event):
+        """ Applies one input to the current shape: 'left', 'right', 'down' or 'rotate' """
+        if event == 'left' or event == 'right':
+            h_movement = -1 if event == 'left' else 1
+            if self.fits(self.rotation_pos, self.shape_row, self.shape_col + h_movement): #not into a wall or other shapes
+                self.shape_col += h_movement
+        elif event == 'rotate':
+            self.rotate_shape()
+        elif event == 'down':
+            self.down_pressed = True
+
+    def tick(self, inputs=()):
+        """ Moves the game on by one step: applies the inputs in order, then
+            moves the current shape down, or places it and spawns the next one
+            if it can't move down anymore
+        """
+        for event in inputs:
+            self.apply_input(event)
+
+        movement_amnt, next_space_free = self.get_next_pos()
+
+        #move/place shape if pos is available
+        if next_space_free:
+            self.shape_row += movement_amnt
+            if self.is_new_shape and any(square_row >= 0 for square_row, _ in self.shape_pos()):
+                self.is_new_shape = False #has been placed on the board, so not new anymore
+        else:
+            self.place_shape()
+            self.down_pressed = False #reset it
+            self.clear_lines() #check for full lines and clear them
+            self.get_random_shape() #change shape
+
+    def step(self, inputs=()):
+        """ tick() for callers outside the bot, returns the state after the tick """
+        if self.shape is None:
+            self.get_random_shape()
+        self.tick(inputs)
+        return self.state()
+
+    def state(self):
+        return GameState(tuple(self.rows), self.shape.code if self.shape else 0, self.rotation_pos, self.shape_row, self.shape_col,
+                         self.next_shape().code, self.points, self.lines, self.game_over)
+
+
+def greedy_inputs(game):
+    """ Inputs that drop the current shape where it leaves the fewest holes, as low as possible
+        Only looks at the col heights, good enough to clear lines in benchmarks
+    """
+    shape = game.shape
+    heights = game.heights
+    best = None
+    for rotation in range(4 if shape.wall_kicks is not no_wall_kicks else 1):
+        left, width, _ = shape.masks[rotation]
+        bottoms = shape.bottoms[rotation]
+        for col in range(-left, num_of_cols - width - left + 1):
+            landing = min(heights[col + square_col] - 1 - square_row for square_col, square_row in bottoms)
+            holes = sum(heights[col + square_col] - 1 - square_row - landing for square_col, square_row in bottoms)
+            score = (-holes, landing)
+            if best is None or score > best[0]:
+                best = (score, rotation, col)
+    _, rotation, col = best
+    moves = col - game.shape_col
+    return ('rotate',) * rotation + (('right',) * moves if moves > 0 else ('left',) * -moves) + ('down',)
+
+
+# Replay logs, a game is written as a start record with its seed, one record
+# per tick and an end record with the score:
+#   start: 0xFF, seed (8 bytes), unix time in ms (8 bytes)
+#   tick:  number of inputs (1 byte), the inputs packed 4 per byte, ms since the last tick (varint)
+#   end:   0xFE, points (varint), lines (varint)
+# A tick without inputs takes 3 bytes. Files start with replay_magic and are only ever appended to,
+# the bot appends every few ticks while a game runs, so a crash only loses the last few.
+replay_magic = b'TTRP\x01'
+replay_start = 0xFF
+replay_end = 0xFE
+replay_max_inputs = 0xFD
+replay_extension = '.ttrp'
+
+
+def write_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, pos):
+    """ Returns (value, position after it) """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class ReplayLog:
+    """ Collects the replay records of a game in memory until take() hands them to append_replay() """
+    __slots__ = ('buffer', 'last_time', 'ticks')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.last_time = 0.0
+        self.ticks = 0 #ticks in the buffer, not taken yet
+
+    def start(self, seed, now):
+        """ now is the clock the tick times come from, like loop.time() """
+        self.buffer.append(replay_start)
+        self.buffer += struct.pack('<QQ', seed & 0xFFFFFFFFFFFFFFFF, int(time.time() * 1000))
+        self.last_time = now
+
+    def tick(self, inputs, now):
+        if len(inputs) > replay_max_inputs:
+            raise ValueError(f"can't log more than {replay_max_inputs} inputs in one tick")
+        buffer = self.buffer
+        buffer.append(len(inputs))
+        packed = 0
+        for i, event in enumerate(inputs):
+            packed |= TetrisGame.moves.index(event) << (i & 3) * 2
+            if i & 3 == 3:
+                buffer.append(packed)
+                packed = 0
+        if len(inputs) & 3:
+            buffer.append(packed)
+        write_varint(buffer, max(0, round((now - self.last_time) * 1000)))
+        self.last_time = now
+        self.ticks += 1
+
+    def end(self, points, lines):
+        self.buffer.append(replay_end)
+        write_varint(self.buffer, points)
+        write_varint(self.buffer, lines)
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.ticks = 0
+        return data
+
+
+def append_replay(path, data):
+    """ Appends records to a replay file, blocking, so the bot runs it in an executor """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab') as file:
+        if file.tell() == 0:
+            file.write(replay_magic)
+        file.write(data)
+
+
+def read_replay(path):
+    """ Returns the games in a replay file as dicts with seed, started (unix ms),
+        ticks [(inputs, ms since the last tick), ...] and points and lines, which
+        are None if the game was stopped before it ended
+        A record the bot was writing when it died is left out.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(replay_magic):
+        raise ValueError(f"{path} is not a replay file")
+    games = []
+    game = None
+    pos = len(replay_magic)
+    try:
+        while pos < len(data):
+            kind = data[pos]
+            pos += 1
+            if kind == replay_start:
+                seed, started = struct.unpack_from('<QQ', data, pos)
+                pos += 16
+                game = {'seed': seed, 'started': started, 'ticks': [], 'points': None, 'lines': None}
+                games.append(game)
+            elif kind == replay_end:
+                points, pos = read_varint(data, pos)
+                game['lines'], pos = read_varint(data, pos)
+                game['points'] = points
+            else:
+                inputs = []
+                for i in range(kind):
+                    if i & 3 == 0:
+                        packed = data[pos]
+                        pos += 1
+                    inputs.append(TetrisGame.moves[packed >> (i & 3) * 2 & 3])
+                delay, pos = read_varint(data, pos)
+                game['ticks'].append((tuple(inputs), delay))
+    except (IndexError, struct.error):
+        pass #the file ends in the middle of a record
+    return games
+
+
+def replay(game_log):
+    """ Plays a game from read_replay() again as fast as possible
+        Returns (the finished TetrisGame, seconds)
+    """
+    game = TetrisGame(game_log['seed'])
+    game.get_random_shape()
+    tick = game.tick
+    start = time.perf_counter()
+    for inputs, _ in game_log['ticks']:
+        tick(inputs)
+    return game, time.perf_counter() - start
+
+
+def play(game, ticks, pick_inputs):
+    """ Runs ticks ticks, starting a new game with the next seed at every game over
+        pick_inputs(tick) returns the inputs of that tick
+        Returns (seconds, games finished, lines cleared)
+    """
+    if game.shape is None:
+        game.get_random_shape()
+    games = 0
+    lines = 0
+    tick = game.tick
+    start = time.perf_counter()
+    for i in range(ticks):
+        tick(pick_inputs(i))
+        if game.game_over:
+            games += 1
+            lines += game.lines
+            game.reset(game.seed + 1)
+            game.get_random_shape()
+    return time.perf_counter() - start, games, lines + game.lines
+
+
+def benchmark(ticks=100000, seed=0, names=None):
+    """ Ticks per second of a few ways of playing, all of them or the ones in names
+        Returns {name: (ticks per second, games, lines cleared)}
+    """
+    rng = random.Random(seed)
+    placed = [None] #(seed, index) of the last shape greedy_inputs() was used for
+
+    def place(i):
+        if placed[0] == (game.seed, game.index):
+            return ()
+        placed[0] = (game.seed, game.index)
+        return greedy_inputs(game)
+
+    moves = [rng.choice(((), ('left',), ('right',), ('rotate',), ('down',), (), (), ())) for _ in range(4096)]
+    scenarios = {
+        'idle': lambda i: (), #pieces only fall
+        'random': lambda i: moves[i & 4095], #random moves like a player
+        'hard drops': lambda i: ('down',), #every piece dropped right away
+        'rotations': lambda i: ('rotate',) if i % 4 else ('rotate', 'down'), #wall kicks on every tick
+        'line clears': place, #places every shape to clear lines, includes the time greedy_inputs() takes
+    }
+    results = {}
+    for name, pick_inputs in scenarios.items():
+        if names is not None and name not in names:
+            continue
+        game = TetrisGame(seed)
+        seconds, games, lines = play(game, ticks, pick_inputs)
+        results[name] = (ticks / seconds, games, lines)
+    return results
+
+
+def replay_files(paths):
+    """ Replays every game in the files and checks the scores match the log """
+    ticks = 0
+    seconds = 0
+    for path in paths:
+        for game_log in read_replay(path):
+            game, took = replay(game_log)
+            ticks += len(game_log['ticks'])
+            seconds += took
+            if game_log['points'] is None:
+                result = "stopped"
+            elif (game.points, game.lines) == (game_log['points'], game_log['lines']):
+                result = "matches"
+            else:
+                result = f"DIFFERS, logged {game_log['points']} points {game_log['lines']} lines"
+            played = sum(delay for _, delay in game_log['ticks']) / 1000
+            print(f"> {os.path.basename(path)} seed {game_log['seed']}: {len(game_log['ticks'])} ticks, {played:.0f}s played, "
+                  f"{game.points} points {game.lines} lines, {result}")
+    if seconds:
+        print(f"> {ticks} ticks replayed in {seconds:.3f}s ({ticks / seconds:.0f} ticks/s)")
+
+
+if __name__ == '__main__':
+    # python tetris.py [ticks] [seed]
+    # python tetris.py replay <log> [log ...]
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'replay':
+        if len(sys.argv) < 3:
+            exit("usage: python tetris.py replay <log> [log ...]")
+        replay_files(sys.argv[2:])
+        exit()
+
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for name, (per_second, games, lines) in benchmark(ticks, seed).items():
+        print(f"> {name:<12} {per_second:>10.0f} ticks/s {games:>6} games {lines:>6} lines")